@@ -3,16 +3,12 @@ import numpy as np
 import math
 import itertools
 from jahan.VectorArithmetic import Vector2D, Segment2D, Vector2D_fromList
-from collections import defaultdict
 from scipy.spatial import Delaunay, Voronoi
 
 # ======================================================================================================================
 # Canvas Data Structures
 # ======================================================================================================================
 
-rnd.seed(10)
-
-
 def generateFinite2DVoronoi(vor, radius=None):
     """
     Reconstruct infinite voronoi regions in a 2D diagram to finite regions.
@@ -41,7 +37,7 @@ def generateFinite2DVoronoi(vor, radius=None):
 
     center = vor.points.mean(axis=0)
     if radius is None:
-        radius = vor.points.ptp().max()
+        radius = np.ptp(vor.points).max()
 
     # Construct a map containing all ridges for a given point
     all_ridges = {}
@@ -95,38 +91,64 @@ def generateFinite2DVoronoi(vor, radius=None):
 
 
 class Canvas2D:
-    __seeds: list = []
-    __neighbours: dict = {}
-    __voronoi_vertices = None
-    __voronoi_regions = None
-
-    def __init__(self, pointList):
-        self.__seeds = pointList
+    """
+    Seeds of a canvas with their Delaunay neighbours and Voronoi cells. Seeds, neighbours (in CSR form) and cells (as
+    flat vertex indices with offsets) are kept in arrays. Unless 'compact' is set, the Vector2D seeds and cells are
+    also kept around; a compact canvas creates them on request instead, which saves most of the memory of large
+    canvases.
+    """
+    __seeds: list = None
+    __seedIndices: dict = None
+    __voronoi_polygons: list = None
+
+    def __init__(self, pointList, compact: bool = False):
+        self.__compact = compact
+        self.__points = np.array([p.asList for p in pointList], dtype=np.float64).reshape(-1, 2)
+        self.__points.flags.writeable = False
+
+        tri = Delaunay(self.__points, qhull_options="Qw Qt Qj")
+        indptr, indices = tri.vertex_neighbor_vertices
+        owners = np.repeat(np.arange(len(self.__points)), np.diff(indptr))
+        self.__neighbourIndptr = indptr
+        self.__neighbourIndices = indices[np.lexsort((indices, owners))]
+
+        regions, vertices = generateFinite2DVoronoi(Voronoi(self.__points))
+        self.__voronoi_vertices = vertices
+        self.__voronoi_offsets = np.cumsum([0] + [len(region) for region in regions])
+        self.__voronoi_regions = np.fromiter(itertools.chain.from_iterable(regions),
+                                             dtype=np.int64, count=self.__voronoi_offsets[-1])
 
-        pointsAsList = [p.asList for p in self.__seeds]
+        if not compact:
+            self.__seeds = pointList
+            self.__voronoi_polygons = [self.__createPolygon(i) for i in range(len(self))]
+            self.__createSeedIndices()
 
-        self.__neighbours = defaultdict(set)
-        tri = Delaunay(pointsAsList, qhull_options="Qw Qt Qj")
-        for p in tri.simplices:
-            for i, j in itertools.combinations(p, 2):
-                self.__neighbours[i].add(j)
-                self.__neighbours[j].add(i)
+    def __len__(self):
+        return len(self.__points)
 
-        regions, vertices = generateFinite2DVoronoi(Voronoi(pointsAsList))
-        self.__voronoi_regions = regions
-        self.__voronoi_vertices = vertices
+    def __createSeedIndices(self):
+        # the first of several equal seeds owns the index, as with list.index
+        self.__seedIndices = {}
+        for i, p in enumerate(self.Seeds):
+            self.__seedIndices.setdefault(p, i)
 
-    def __len__(self):
-        return len(self.__seeds)
+    def __createPolygon(self, seedIndex: int) -> list:
+        region = self.__voronoi_regions[self.__voronoi_offsets[seedIndex]:self.__voronoi_offsets[seedIndex + 1]]
+        return [Vector2D_fromList(p) for p in self.__voronoi_vertices[region].tolist()]
 
     def findNearestPoint(self, v: Vector2D, distanceFunction) -> Vector2D:
-        distances = list(map(distanceFunction, [v] * self.size, self.__seeds))
+        seeds = self.Seeds
+        distances = list(map(distanceFunction, [v] * self.size, seeds))
         min_index = distances.index(min(distances))
-        return self.__seeds[min_index]
+        return seeds[min_index]
 
     @property
     def isEmpty(self) -> bool:
-        return len(self.__seeds) == 0
+        return len(self) == 0
+
+    @property
+    def isCompact(self) -> bool:
+        return self.__compact
 
     @property
     def size(self) -> int:
@@ -134,27 +156,33 @@ class Canvas2D:
 
     @property
     def Seeds(self):
-        return self.__seeds.copy()
+        if self.__seeds is not None:
+            return self.__seeds.copy()
+        return [Vector2D_fromList(p) for p in self.__points.tolist()]
 
     @property
     def pointsAsList(self):
-        return [p.asList for p in self.__seeds]
+        return self.__points.tolist()
+
+    @property
+    def seedArray(self) -> np.ndarray:
+        # read-only (N, 2) array of seed positions
+        return self.__points
+
+    @property
+    def neighbourArrays(self):
+        # CSR adjacency: neighbours of seed i are indices[indptr[i]:indptr[i + 1]], in ascending order
+        return self.__neighbourIndptr, self.__neighbourIndices
 
     @property
     def voronoiPolygons(self) -> list:
-        polygons = []
-        for region in self.__voronoi_regions:
-            polygon = self.__voronoi_vertices[region]
-            convertedPoly = [Vector2D_fromList(p) for p in polygon]
-            polygons.append(convertedPoly)
-        return polygons
+        return [self.getPolygonOfSeedIndex(i) for i in range(len(self))]
 
     @property
     def voronoiSegments(self) -> list:
         segments = []
 
-        polygons = self.voronoiPolygons
-        for poly in polygons:
+        for poly in self.voronoiPolygons:
             polyLength = len(poly)
             for i in range(polyLength + 1):
                 segment = Segment2D(poly[i % polyLength],
@@ -162,17 +190,51 @@ class Canvas2D:
                 segments.append(segment)
         return segments
 
+    def hasSeed(self, seed: Vector2D) -> bool:
+        if self.__seedIndices is None:
+            self.__createSeedIndices()
+        return seed in self.__seedIndices
+
+    def getSeedIndex(self, seed: Vector2D) -> int:
+        if not self.hasSeed(seed):
+            raise Exception("Seed {S} is not on the canvas.".format(S=seed))
+        return self.__seedIndices[seed]
+
+    def getSeed(self, seedIndex: int) -> Vector2D:
+        if self.__seeds is not None:
+            return self.__seeds[seedIndex]
+        return Vector2D_fromList(self.__points[seedIndex].tolist())
+
     def getPolygonOfSeed(self, seed: Vector2D) -> list:
-        index = self.__seeds.index(seed)
-        return self.voronoiPolygons[index]
+        return self.getPolygonOfSeedIndex(self.getSeedIndex(seed))
+
+    def getPolygonOfSeedIndex(self, seedIndex: int) -> list:
+        if self.__voronoi_polygons is not None:
+            return self.__voronoi_polygons[seedIndex].copy()
+        return self.__createPolygon(seedIndex)
 
     def getNeighboursOfSeed(self, v: Vector2D) -> list:
-        index = self.__seeds.index(v)
-        neighbour_indices = list(self.__neighbours[index])
-        return [self.__seeds[i] for i in neighbour_indices]
+        neighbour_indices = self.getNeighboursOfSeedIndex(self.getSeedIndex(v))
+        return [self.getSeed(i) for i in neighbour_indices]
 
     def getNeighboursOfSeedIndex(self, seedIndex) -> list:
-        return list(self.__neighbours[seedIndex])
+        return self.__neighbourIndices[self.__neighbourIndptr[seedIndex]:self.__neighbourIndptr[seedIndex + 1]].tolist()
+
+    def getNeighbourhoodOfSeedIndex(self, seedIndex: int, depth: int) -> np.ndarray:
+        """
+        Indices of the seeds at most 'depth' Delaunay steps away from the given seed, itself included, in ascending
+        order. Found with a breadth-first search over the neighbour arrays.
+        """
+        neighbourhood = np.array([seedIndex], dtype=np.int64)
+        frontier = neighbourhood
+        for i in range(depth):
+            if len(frontier) == 0:
+                break
+            reached = np.concatenate([self.__neighbourIndices[self.__neighbourIndptr[f]:self.__neighbourIndptr[f + 1]]
+                                      for f in frontier])
+            frontier = np.setdiff1d(reached, neighbourhood)
+            neighbourhood = np.union1d(neighbourhood, frontier)
+        return neighbourhood
 
 
 # ======================================================================================================================
@@ -203,21 +265,22 @@ class SquareCanvasSeedGenerator(CanvasSeedGenerator):
 
 
 class LooseSquareCanvasSeedGenerator(CanvasSeedGenerator):
-    def __init__(self, width: int, height: int, looseness: float = 0.5):
+    def __init__(self, width: int, height: int, looseness: float = 0.5, seed: int = None):
         self.__w = width
         self.__h = height
         self.__looseness = looseness
+        self.__seed = seed
 
     def generate(self) -> list:
-        rnd.seed()
+        random = rnd.Random(self.__seed)
         points = []
         dx: float = 1 / self.__w
         dy: float = 1 / self.__h
 
         for i in range(self.__w):
             for j in range(self.__h):
-                p = Vector2D(dx * (i + 0.5) + dx * rnd.uniform(-1 * self.__looseness, self.__looseness),
-                             dy * (j + 0.5) + dy * rnd.uniform(-1 * self.__looseness, self.__looseness))
+                p = Vector2D(dx * (i + 0.5) + dx * random.uniform(-1 * self.__looseness, self.__looseness),
+                             dy * (j + 0.5) + dy * random.uniform(-1 * self.__looseness, self.__looseness))
                 points.append(p)
 
         return points
@@ -266,15 +329,16 @@ class RadialCanvasSeedGenerator(CanvasSeedGenerator):
 
 
 class UniformRandomCanvasSeedGenerator(CanvasSeedGenerator):
-    def __init__(self, seedCount: int):
+    def __init__(self, seedCount: int, seed: int = None):
         self.__seedCount = seedCount
+        self.__seed = seed
 
     def generate(self) -> list:
-        rnd.seed()
+        random = rnd.Random(self.__seed)
         points = []
         for i in range(self.__seedCount):
-            x = rnd.random()
-            y = rnd.random()
+            x = random.random()
+            y = random.random()
             points.append(Vector2D(x, y))
 
         return points
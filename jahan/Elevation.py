@@ -1,10 +1,13 @@
 import itertools
+import numpy as np
+import shapely
+from scipy.ndimage import distance_transform_edt
 
 from jahan.Layout import AreaPolygon
 from jahan.GridMap import GridMap, addGrids
+from jahan.Tiling import MapTile, fullMapTile
 import jahan.Noise2D as noise2d
 from jahan.VectorArithmetic import Vector2D
-import multiprocessing
 
 
 def generate_2d_mesh(mapWidth, mapHeight):
@@ -18,17 +21,21 @@ def generate_2d_mesh(mapWidth, mapHeight):
 # ===========================================
 
 class HeightFoundation:
-    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int) -> GridMap:
-        return GridMap(mapWidth, mapHeight)
+    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int, tile: MapTile = None) -> GridMap:
+        if tile is None:
+            tile = fullMapTile(mapWidth, mapHeight)
+        return GridMap(tile.width, tile.height)
 
 
 class Flat_HeightFoundation(HeightFoundation):
     def __init__(self, flatHeight: float):
         self.__H = flatHeight
 
-    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int) -> GridMap:
-        heightMap = GridMap(mapWidth, mapHeight)
-        heightMap.importValues([self.__H] * mapWidth * mapHeight)
+    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int, tile: MapTile = None) -> GridMap:
+        if tile is None:
+            tile = fullMapTile(mapWidth, mapHeight)
+        heightMap = GridMap(tile.width, tile.height)
+        heightMap.asArray()[:] = self.__H
         return heightMap
 
 
@@ -44,30 +51,92 @@ class getSignedDistanceOfPixelToAreaPolygon:
         else:
             return absDist
 
+    def batch(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        return self.polygon.signedDistances(xs, ys)
+
+
+def edtSignedDistanceGrid(polygon: AreaPolygon, tile: MapTile, mapWidth: int, mapHeight: int) -> np.ndarray:
+    """
+    Signed distances of the pixels of 'tile' to the polygon, from distance transforms of its rasterized mask over the
+    tile and a halo around it. Borders sit half a pixel away from the pixel centers next to them.
+    """
+    # inside pixels find the border within the deepest pixel distance, so a halo that wide settles them, but the halo
+    # is capped at the tile size and the window kept on the map and within a ring of outside pixels around the polygon
+    halo = min(int(np.ceil(polygon.deepestPixelDistance(mapWidth, mapHeight))) + 2, max(tile.width, tile.height))
+    outline = np.asarray(polygon.superCellPointsAsList, dtype=np.float64)
+    x0, y0 = np.floor(outline.min(axis=0)).astype(int) - 1
+    x1, y1 = np.ceil(outline.max(axis=0)).astype(int) + 2
+    ring = MapTile(x0, y0, x1 - x0, y1 - y0)
+    window = MapTile(tile.x - halo, tile.y - halo, tile.width + 2 * halo, tile.height + 2 * halo)
+    window = window.intersection(ring).clipped(mapWidth, mapHeight)
+
+    # pixels the window misses, further from the border than the halo or whose nearest pixel across the border might
+    # lie beyond the map, are measured exactly instead, which keeps every pixel's result independent of the tiling
+    signedDistance = np.full((tile.height, tile.width), np.inf)
+    if not window.isEmpty:
+        xs, ys = window.pixelGrid()
+        inside = shapely.intersects_xy(polygon.shape, xs, ys)
+        insideDistance = distance_transform_edt(inside) - 0.5 if not inside.all() else np.full(inside.shape, np.inf)
+        outsideDistance = distance_transform_edt(~inside) - 0.5 if inside.any() else np.full(inside.shape, np.inf)
+        windowDistance = np.where(inside, -1 * insideDistance, outsideDistance)
+
+        reach = np.full(inside.shape, float(halo))
+        if window.x > ring.x:
+            reach = np.minimum(reach, xs - window.x + 1)
+        if window.y > ring.y:
+            reach = np.minimum(reach, ys - window.y + 1)
+        if window.x + window.width < ring.x + ring.width:
+            reach = np.minimum(reach, window.x + window.width - xs)
+        if window.y + window.height < ring.y + ring.height:
+            reach = np.minimum(reach, window.y + window.height - ys)
+        windowDistance[np.abs(windowDistance) + 0.5 > reach] = np.inf
+
+        overlap = tile.intersection(window)
+        signedDistance[overlap.slicesIn(tile)] = windowDistance[overlap.slicesIn(window)]
+
+    far = np.isinf(signedDistance)
+    if far.any():
+        tileXs, tileYs = tile.pixelGrid()
+        signedDistance[far] = polygon.signedDistances(tileXs[far], tileYs[far])
+    return signedDistance
+
+
+SDF_EXACT = "exact"
+SDF_EDT = "edt"
+
 
 class SDF_HeightFoundation(HeightFoundation):
-    def __init__(self, ascending: bool, minHeight: float, maxHeight: float):
+    """
+    SDF_EXACT measures the distance from every pixel to the polygon outline, SDF_EDT derives it from distance
+    transforms of the rasterized polygon, which is cheaper for large areas.
+    """
+
+    def __init__(self, ascending: bool, minHeight: float, maxHeight: float, method: str = SDF_EXACT):
+        if method not in (SDF_EXACT, SDF_EDT):
+            raise Exception("Unknown SDF method: {M}".format(M=method))
         self.__ascending = ascending
         self.__minH = min(minHeight, maxHeight)
         self.__maxH = max(minHeight, maxHeight)
+        self.__method = method
 
-    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int) -> GridMap:
-        pixelList = generate_2d_mesh(mapWidth, mapHeight)
+    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int, tile: MapTile = None) -> GridMap:
+        if tile is None:
+            tile = fullMapTile(mapWidth, mapHeight)
 
-        pool = multiprocessing.Pool(processes=4)
-        pixelDistanceValues = list(pool.map(getSignedDistanceOfPixelToAreaPolygon(polygon), pixelList))
+        if self.__method == SDF_EDT:
+            pixelDistanceValues = edtSignedDistanceGrid(polygon, tile, mapWidth, mapHeight)
+        else:
+            pixelDistanceValues = getSignedDistanceOfPixelToAreaPolygon(polygon).batch(*tile.pixelGrid())
 
-        absoluteMinDist = abs(min(pixelDistanceValues))
-        pixelDistanceValues = [d / absoluteMinDist for d in pixelDistanceValues]
+        # normalized by the deepest pixel of the whole polygon, cached on it, so every tile shares the same scale
+        pixelDistanceValues = pixelDistanceValues / polygon.deepestPixelDistance(mapWidth, mapHeight)
         diffH = self.__maxH - self.__minH
         if self.__ascending:
-            pixelDistanceValues = [self.__minH - diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__minH - diffH * pixelDistanceValues
         else:
-            pixelDistanceValues = [self.__maxH + diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__maxH + diffH * pixelDistanceValues
 
-        heightMap = GridMap(mapWidth, mapHeight)
-        heightMap.importValues(pixelDistanceValues)
-        return heightMap
+        return GridMap(tile.width, tile.height, pixelDistanceValues)
 
 
 def ease(x: float):
@@ -77,6 +146,11 @@ def ease(x: float):
         return 1 - ((-2 * x + 2) ** 3) / 2
 
 
+def easeArray(x: np.ndarray) -> np.ndarray:
+    # float_power rounds exactly like the ** of Python floats in ease
+    return np.where(x < 0.5, 4 * x * x * x, 1 - np.float_power(-2 * x + 2, 3) / 2)
+
+
 class distance_from_point:
     def __init__(self, center_of_mass, polygon, applyEasing=False):
         self.center_of_mass = center_of_mass
@@ -90,6 +164,20 @@ class distance_from_point:
             return ease(min(dist, 1.0))
         return min(dist, 1.0)
 
+    def batch(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        dx = self.center_of_mass.X - xs
+        dy = self.center_of_mass.Y - ys
+        dist = np.minimum(np.sqrt(dx * dx + dy * dy) / self.max_seed_dist, 1.0)
+        if self.applyEasing:
+            return easeArray(dist)
+        return dist
+
+
+def mapCorners(mapWidth: int, mapHeight: int):
+    xs = np.array([0, mapWidth - 1, 0, mapWidth - 1])
+    ys = np.array([0, 0, mapHeight - 1, mapHeight - 1])
+    return xs, ys
+
 
 class Cone_HeightFoundation(HeightFoundation):
     def __init__(self, ascending: bool, minHeight: float, maxHeight: float):
@@ -97,25 +185,24 @@ class Cone_HeightFoundation(HeightFoundation):
         self.__minH = min(minHeight, maxHeight)
         self.__maxH = max(minHeight, maxHeight)
 
-    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int) -> GridMap:
-        pixelList = generate_2d_mesh(mapWidth, mapHeight)
+    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int, tile: MapTile = None) -> GridMap:
+        if tile is None:
+            tile = fullMapTile(mapWidth, mapHeight)
 
-        pool = multiprocessing.Pool(processes=4)
         center_of_mass = polygon.centerOfMass
         dist_func = distance_from_point(center_of_mass, polygon, False)
-        pixelDistanceValues = list(pool.map(dist_func, pixelList))
+        pixelDistanceValues = dist_func.batch(*tile.pixelGrid())
 
-        maxDist = abs(max(pixelDistanceValues))
-        pixelDistanceValues = [d / maxDist for d in pixelDistanceValues]
+        # the distance grows away from the center, so the farthest pixel of the map is one of its corners
+        maxDist = abs(dist_func.batch(*mapCorners(mapWidth, mapHeight)).max())
+        pixelDistanceValues = pixelDistanceValues / maxDist
         diffH = self.__maxH - self.__minH
         if self.__ascending:
-            pixelDistanceValues = [self.__maxH - diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__maxH - diffH * pixelDistanceValues
         else:
-            pixelDistanceValues = [self.__minH + diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__minH + diffH * pixelDistanceValues
 
-        heightMap = GridMap(mapWidth, mapHeight)
-        heightMap.importValues(pixelDistanceValues)
-        return heightMap
+        return GridMap(tile.width, tile.height, pixelDistanceValues)
 
 
 class Bell_HeightFoundation(HeightFoundation):
@@ -124,25 +211,24 @@ class Bell_HeightFoundation(HeightFoundation):
         self.__minH = min(minHeight, maxHeight)
         self.__maxH = max(minHeight, maxHeight)
 
-    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int) -> GridMap:
-        pixelList = generate_2d_mesh(mapWidth, mapHeight)
+    def __call__(self, polygon: AreaPolygon, mapWidth: int, mapHeight: int, tile: MapTile = None) -> GridMap:
+        if tile is None:
+            tile = fullMapTile(mapWidth, mapHeight)
 
-        pool = multiprocessing.Pool(processes=4)
         center_of_mass = polygon.centerOfMass
         dist_func = distance_from_point(center_of_mass, polygon, True)
-        pixelDistanceValues = list(pool.map(dist_func, pixelList))
+        pixelDistanceValues = dist_func.batch(*tile.pixelGrid())
 
-        maxDist = abs(max(pixelDistanceValues))
-        pixelDistanceValues = [d / maxDist for d in pixelDistanceValues]
+        # easing keeps the order of distances, so the largest value is still found at a corner of the map
+        maxDist = abs(dist_func.batch(*mapCorners(mapWidth, mapHeight)).max())
+        pixelDistanceValues = pixelDistanceValues / maxDist
         diffH = self.__maxH - self.__minH
         if self.__ascending:
-            pixelDistanceValues = [self.__maxH - diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__maxH - diffH * pixelDistanceValues
         else:
-            pixelDistanceValues = [self.__minH + diffH * d for d in pixelDistanceValues]
+            pixelDistanceValues = self.__minH + diffH * pixelDistanceValues
 
-        heightMap = GridMap(mapWidth, mapHeight)
-        heightMap.importValues(pixelDistanceValues)
-        return heightMap
+        return GridMap(tile.width, tile.height, pixelDistanceValues)
 
 
 # ===========================================
@@ -150,9 +236,17 @@ class Bell_HeightFoundation(HeightFoundation):
 # ===========================================
 
 class HeightNoiseGenerator:
-    def __init__(self, amplitude: float, scale: float):
+    """
+    Generated maps are memoized in 'cache' (noise2d.NOISE_MAP_CACHE by default), keyed on the generator class, its
+    parameters, seed, map size and tile, so generators shared by many areas only compute each map once. Every
+    returned map is a writable copy.
+    """
+
+    def __init__(self, amplitude: float, scale: float, seed: int = None, cache: noise2d.NoiseMapCache = None):
         self.__a = amplitude
         self.__s = scale
+        self.__seed = noise2d.generateNoiseSeed() if seed is None else seed
+        self.__cache = cache
 
     @property
     def amplitude(self):
@@ -162,52 +256,87 @@ class HeightNoiseGenerator:
     def scale(self):
         return self.__s
 
-    def generateNoiseMap(self, width: int, height: int) -> GridMap:
-        return GridMap(width, height)
+    @property
+    def seed(self):
+        return self.__seed
+
+    @property
+    def cache(self) -> noise2d.NoiseMapCache:
+        return self.__cache if self.__cache is not None else noise2d.NOISE_MAP_CACHE
+
+    def _parameters(self) -> tuple:
+        return self.__a, self.__s
+
+    def _generateNoise(self, width: int, height: int, tile: MapTile):
+        return np.zeros((tile.height, tile.width))
+
+    def generateNoiseMap(self, width: int, height: int, tile: MapTile = None, bounds: MapTile = None) -> GridMap:
+        """
+        Noise of 'tile', the whole map if None. Given 'bounds', a tile holding 'tile', the noise of all of 'bounds' is
+        generated and cached and 'tile' is cut out of it, so areas covering parts of one map or pipeline tile share a
+        single cache entry.
+        """
+        if tile is None:
+            tile = fullMapTile(width, height)
+        if bounds is None:
+            bounds = tile
+        key = (type(self), self._parameters(), self.__seed, width, height, bounds)
+        # generators return flat, row by row values, the cache keeps them as a (height, width) grid to cut tiles from
+        noise = self.cache.getOrGenerate(key,
+                                         lambda: np.reshape(self._generateNoise(width, height, bounds),
+                                                            (bounds.height, bounds.width)),
+                                         tile.slicesIn(bounds))
+        return GridMap(tile.width, tile.height, noise)
 
 
 class WhiteHeightNoiseGenerator(HeightNoiseGenerator):
-    def generateNoiseMap(self, width: int, height: int) -> GridMap:
-        noise = noise2d.whiteNoise(width, height, self.amplitude)
-        m: GridMap = GridMap(width, height)
-        m.importValues(noise)
-        return m
+    def __init__(self, amplitude: float, scale: float, seed: int = None, cache: noise2d.NoiseMapCache = None):
+        super().__init__(amplitude, scale, seed, cache)
+        self.__noise = noise2d.WhiteNoise2D(self.seed)
+
+    def _generateNoise(self, width: int, height: int, tile: MapTile):
+        return self.__noise.generate(width, height, self.amplitude, tile)
 
 
 class PerlinHeightNoiseGenerator(HeightNoiseGenerator):
-    def __init__(self, amplitude=1, scale=8, octaves=4):
-        super().__init__(amplitude, scale)
+    def __init__(self, amplitude=1, scale=8, octaves=4, seed: int = None, cache: noise2d.NoiseMapCache = None):
+        super().__init__(amplitude, scale, seed, cache)
         self.octaves = octaves
+        self.__noise = noise2d.PerlinNoise2D(self.seed)
+
+    def _parameters(self) -> tuple:
+        return self.amplitude, self.scale, self.octaves
 
-    def generateNoiseMap(self, width: int, height: int) -> GridMap:
-        noise = noise2d.perlinNoise(width, height, self.amplitude, self.scale, self.octaves)
-        m: GridMap = GridMap(width, height)
-        m.importValues(noise)
-        return m
+    def _generateNoise(self, width: int, height: int, tile: MapTile):
+        return self.__noise.generate(width, height, self.amplitude, self.scale, self.octaves, tile)
 
 
 class OpenSimplexHeightNoiseGenerator(HeightNoiseGenerator):
-    def __init__(self, amplitude=1, scale=8, octaves=4):
-        super().__init__(amplitude, scale)
+    def __init__(self, amplitude=1, scale=8, octaves=4, seed: int = None, cache: noise2d.NoiseMapCache = None):
+        super().__init__(amplitude, scale, seed, cache)
         self.octaves = octaves
+        self.__noise = noise2d.OpenSimplexNoise2D(self.seed)
 
-    def generateNoiseMap(self, width: int, height: int) -> GridMap:
-        noise = noise2d.openSimplexNoise(width, height, self.amplitude, self.scale, self.octaves)
-        m: GridMap = GridMap(width, height)
-        m.importValues(noise)
-        return m
+    def _parameters(self) -> tuple:
+        return self.amplitude, self.scale, self.octaves
+
+    def _generateNoise(self, width: int, height: int, tile: MapTile):
+        return self.__noise.generate(width, height, self.amplitude, self.scale, self.octaves, tile)
 
 
 class WorleyHeightNoiseGenerator(HeightNoiseGenerator):
-    def __init__(self, amplitude=1, scale=8, seedCount=50):
-        super().__init__(amplitude, scale)
+    def __init__(self, amplitude=1, scale=8, seedCount=50, feature=noise2d.WORLEY_F1, seed: int = None,
+                 cache: noise2d.NoiseMapCache = None):
+        super().__init__(amplitude, scale, seed, cache)
         self.seedCount = seedCount
+        self.feature = feature
+        self.__noise = noise2d.WorleyNoise2D(self.seed)
+
+    def _parameters(self) -> tuple:
+        return self.amplitude, self.scale, self.seedCount, self.feature
 
-    def generateNoiseMap(self, width: int, height: int) -> GridMap:
-        noise = noise2d.worleyNoise(width, height, self.amplitude, self.seedCount)
-        m: GridMap = GridMap(width, height)
-        m.importValues(noise)
-        return m
+    def _generateNoise(self, width: int, height: int, tile: MapTile):
+        return self.__noise.generate(width, height, self.amplitude, self.seedCount, self.feature, tile)
 
 
 # ===========================================
@@ -219,9 +348,11 @@ class HeightProfile:
         self.__foundation: HeightFoundation = foundation
         self.__detail = detail
 
-    def heightMapForPolygon(self, polygon, mapWidth, mapHeight):
-        foundationHeight = self.__foundation(polygon, mapWidth, mapHeight)
+    def heightMapForPolygon(self, polygon, mapWidth, mapHeight, tile: MapTile = None, bounds: MapTile = None):
+        # 'bounds' is the map or pipeline tile that 'tile' is part of, detail noise is shared at that granularity
+        foundationHeight = self.__foundation(polygon, mapWidth, mapHeight, tile)
         if self.__detail is not None:
-            return addGrids(foundationHeight, self.__detail.generateNoiseMap(mapWidth, mapHeight))
+            noise = self.__detail.generateNoiseMap(mapWidth, mapHeight, tile, bounds)
+            return addGrids(foundationHeight, noise, out=foundationHeight)
         else:
             return foundationHeight
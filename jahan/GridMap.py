@@ -1,14 +1,78 @@
 import numpy as np
 
 
+def _valuesDtype(values, dtype):
+    # floating arrays keep their dtype, so they can be wrapped without a copy, while lists and integer arrays become
+    # float64, so later writes of fractions are not truncated
+    if dtype is not None:
+        return dtype
+    valuesDtype = getattr(values, "dtype", None)
+    if valuesDtype is not None and np.issubdtype(valuesDtype, np.floating):
+        return valuesDtype
+    return np.float64
+
+
 class GridMap:
-    def __init__(self, w: int, h: int):
+    def __init__(self, w: int, h: int, values=None, dtype=None):
+        dtype = _valuesDtype(values, dtype)
         self.__width = w
         self.__height = h
-        self.__values = [0.0] * (w * h)
+        if values is None:
+            self.__values = np.zeros((h, w), dtype=dtype)
+        else:
+            self.__values = self.__asGrid(values, dtype)
 
     def __len__(self):
-        return len(self.__values)
+        return self.__values.size
+
+    def __add__(self, other):
+        if isinstance(other, GridMap):
+            return addGrids(self, other)
+        return GridMap(self.__width, self.__height, self.__values + other)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __iadd__(self, other):
+        if isinstance(other, GridMap):
+            return addGrids(self, other, out=self)
+        np.add(self.__values, other, out=self.__values)
+        return self
+
+    def __sub__(self, other):
+        if isinstance(other, GridMap):
+            return subGrids(self, other)
+        return GridMap(self.__width, self.__height, self.__values - other)
+
+    def __isub__(self, other):
+        if isinstance(other, GridMap):
+            return subGrids(self, other, out=self)
+        np.subtract(self.__values, other, out=self.__values)
+        return self
+
+    def __mul__(self, other):
+        if isinstance(other, GridMap):
+            return mulGrids(self, other)
+        return scaleGrid(self, other)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __imul__(self, other):
+        if isinstance(other, GridMap):
+            return mulGrids(self, other, out=self)
+        return scaleGrid(self, other, out=self)
+
+    def __truediv__(self, other):
+        if isinstance(other, GridMap):
+            return divGrids(self, other)
+        return GridMap(self.__width, self.__height, self.__values / other)
+
+    def __itruediv__(self, other):
+        if isinstance(other, GridMap):
+            return divGrids(self, other, out=self)
+        np.divide(self.__values, other, out=self.__values)
+        return self
 
     def __isValidIndex(self, x: int, y: int):
         return 0 <= x < self.__width and 0 <= y < self.__height
@@ -16,38 +80,49 @@ class GridMap:
     def __extractCoordinates(self, index):
         return index / self.__width, index % self.__height
 
-    def __extractIndex(self, x: int, y: int):
-        return y * self.__width + x
+    def __asGrid(self, values, dtype):
+        # arrays of the right shape and dtype are wrapped as they are, everything else is copied once
+        grid = np.asarray(values, dtype=dtype)
+        if grid.size != self.__width * self.__height:
+            raise Exception(
+                "Cannot import values. {A} != {B}".format(A=grid.size, B=self.__width * self.__height))
+        if grid.shape != (self.__height, self.__width):
+            grid = grid.reshape(self.__height, self.__width)
+        if not grid.flags.c_contiguous:
+            grid = np.ascontiguousarray(grid)
+        return grid
 
     def getValue(self, x, y):
         x = int(x)
         y = int(y)
 
         if self.__isValidIndex(x, y):
-            index = self.__extractIndex(x, y)
-            return self.__values[index]
+            return self.__values[y, x].item()
         else:
             raise IndexError("X and Y are not valid for GrayscaleMap")
 
     def setValue(self, x: int, y: int, value: float):
         if self.__isValidIndex(x, y):
             if 0 <= value <= 1:
-                index = self.__extractIndex(x, y)
-                self.__values[index] = value
+                self.__values[y, x] = value
             else:
                 raise Exception("Values in GrayscaleMaps should in [0.0, 1.0]")
         else:
             raise IndexError("X and Y are not valid for GrayscaleMap")
 
-    def importValues(self, values: list):
-        if len(values) == self.__width * self.__height:
-            self.__values = values.copy()
-        else:
-            raise Exception(
-                "Cannot import values. {A} != {B}".format(A=len(values), B=self.__width * self.__height))
+    def importValues(self, values):
+        dtype = self.__values.dtype
+        self.__values = self.__asGrid(np.array(values, dtype=dtype), dtype)
 
     def exportValues(self):
-        return self.__values.copy()
+        return self.__values.ravel().tolist()
+
+    def asArray(self) -> np.ndarray:
+        """
+        Returns the (height, width) array backing this map without copying it.
+        Writing into the returned array changes the map.
+        """
+        return self.__values
 
     @property
     def width(self):
@@ -57,6 +132,10 @@ class GridMap:
     def height(self):
         return self.__height
 
+    @property
+    def dtype(self):
+        return self.__values.dtype
+
     @property
     def valueRange(self) -> float:
         minV = np.nanmin(self.__values)
@@ -73,114 +152,167 @@ class GridMap:
 
     @property
     def asListOfListsForImShow(self):
-        ret = []
-        for y in range(1, self.height):
-            ret.append([])
-            for x in range(1, self.width):
-                ret[y - 1].append(self.getValue(x, self.height - y))
-        return ret
+        # rows from top to bottom, skipping the first row and column like the plotting code expects
+        return self.__values[self.height - 1:0:-1, 1:].tolist()
 
     def exportFor3DPlotting(self):
-        values = []
-        for i in range(len(self.__values)):
-            x = int(i % self.__height)
-            y = int(i / self.__width)
-            values.append(self.getValue(x, y))
-        return values
+        return self.exportValues()
 
     def exportForContour(self):
-        values = []
-        for i in range(len(self.__values)):
-            x = int(i % self.__height)
-            y = int(i / self.__width)
-            values.append(self.getValue(x, y))
-        return values
+        return self.exportValues()
+
+
+class GridMapStack:
+    """
+    Named layers of equally sized maps stored as one (layers, height, width) array.
+    Layers handed out by this class are GridMap views into the stack, not copies.
+    """
+
+    def __init__(self, names: list, w: int, h: int, values=None, dtype=None):
+        dtype = _valuesDtype(values, dtype)
+        self.__names = list(names)
+        self.__index = {name: i for i, name in enumerate(self.__names)}
+        self.__width = w
+        self.__height = h
+        shape = (len(self.__names), h, w)
+        if values is None:
+            self.__values = np.zeros(shape, dtype=dtype)
+        else:
+            values = np.asarray(values, dtype=dtype)
+            if values.size != len(self.__names) * w * h:
+                raise Exception(
+                    "Cannot import layers. {A} != {B}".format(A=values.size, B=len(self.__names) * w * h))
+            if values.shape != shape:
+                values = values.reshape(shape)
+            self.__values = np.ascontiguousarray(values)
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __contains__(self, name):
+        return name in self.__index
+
+    def __getitem__(self, name) -> GridMap:
+        return GridMap(self.__width, self.__height, self.__values[self.__index[name]], self.__values.dtype)
+
+    def indexOf(self, name) -> int:
+        return self.__index[name]
 
+    def asArray(self) -> np.ndarray:
+        return self.__values
 
-def addGrids(a: GridMap, b: GridMap):
+    @property
+    def names(self) -> list:
+        return self.__names.copy()
+
+    @property
+    def width(self):
+        return self.__width
+
+    @property
+    def height(self):
+        return self.__height
+
+    def normalize(self, out=None):
+        """
+        Divides every layer by the per-pixel sum of all layers. Pixels where the sum is zero become zero,
+        exactly like divGrids. Pass out=self to normalize in place.
+        """
+        if out is None:
+            out = GridMapStack(self.__names, self.__width, self.__height,
+                               dtype=np.result_type(self.__values.dtype, np.float64))
+        sums = np.sum(self.__values, axis=0)
+        zeros = sums == 0.0
+        np.divide(self.__values, sums, out=out.asArray(), where=~zeros)
+        out.asArray()[:, zeros] = 0.0
+        return out
+
+    def toGridMaps(self) -> dict:
+        return {name: self[name] for name in self.__names}
+
+
+def GridMapStack_fromGridMaps(maps: dict) -> GridMapStack:
+    layers = list(maps.values())
+    w = layers[0].width
+    h = layers[0].height
+    for layer in layers:
+        if len(layer) != w * h:
+            raise Exception("Cannot STACK Grids with different sizes")
+    values = np.stack([layer.asArray().reshape(h, w) for layer in layers])
+    return GridMapStack(list(maps.keys()), w, h, values)
+
+
+def _resultMap(a: GridMap, b, out: GridMap, opName: str) -> GridMap:
+    if out is None:
+        dtype = np.result_type(a.dtype, b.dtype if isinstance(b, GridMap) else b)
+        return GridMap(a.width, a.height, dtype=dtype)
+    elif len(out) == len(a):
+        return out
+    else:
+        raise Exception("Cannot {OP} Grids into an output with a different size".format(OP=opName))
+
+
+def _valuesLike(a: GridMap, b: GridMap) -> np.ndarray:
+    return b.asArray().reshape(a.height, a.width)
+
+
+def addGrids(a: GridMap, b: GridMap, out: GridMap = None):
     if len(a) == len(b):
-        bValues = b.exportValues()
-        aValues = a.exportValues()
-        sums = [aValues[i] + bValues[i] for i in range(len(a))]
-        newMap = GridMap(a.width, a.height)
-        newMap.importValues(sums)
+        newMap = _resultMap(a, b, out, "ADD")
+        np.add(a.asArray(), _valuesLike(a, b), out=newMap.asArray())
         return newMap
     else:
         raise Exception("Cannot ADD Grids with different sizes")
 
 
-def subGrids(a: GridMap, b: GridMap):
+def subGrids(a: GridMap, b: GridMap, out: GridMap = None):
     if len(a) == len(b):
-        bValues = b.exportValues()
-        aValues = a.exportValues()
-        sums = [aValues[i] - bValues[i] for i in range(len(a))]
-        newMap = GridMap(a.width, a.height)
-        newMap.importValues(sums)
+        newMap = _resultMap(a, b, out, "SUB")
+        np.subtract(a.asArray(), _valuesLike(a, b), out=newMap.asArray())
         return newMap
     else:
         raise Exception("Cannot SUB Grids with different sizes")
 
 
-def divGrids(a: GridMap, b: GridMap):
+def divGrids(a: GridMap, b: GridMap, out: GridMap = None):
     if len(a) == len(b):
-        bValues = b.exportValues()
-        aValues = a.exportValues()
+        newMap = _resultMap(a, b, out, "DIV")
+        bValues = _valuesLike(a, b)
 
-        divs = []
-        for i in range(len(a)):
-            if bValues[i] == 0.0:
-                divs.append(0.0)
-            else:
-                divs.append(aValues[i] / bValues[i])
-
-        newMap = GridMap(a.width, a.height)
-        newMap.importValues(divs)
+        # division by zero gives zero, the mask is taken before 'out' may overwrite b
+        zeros = bValues == 0.0
+        np.divide(a.asArray(), bValues, out=newMap.asArray(), where=~zeros)
+        newMap.asArray()[zeros] = 0.0
         return newMap
     else:
         raise Exception("Cannot DIV Grids with different sizes")
 
 
-def mulGrids(a: GridMap, b: GridMap):
+def mulGrids(a: GridMap, b: GridMap, out: GridMap = None):
     if len(a) == len(b):
-        bValues = b.exportValues()
-        aValues = a.exportValues()
-        sums = [aValues[i] * bValues[i] for i in range(len(a))]
-        newMap = GridMap(a.width, a.height)
-        newMap.importValues(sums)
+        newMap = _resultMap(a, b, out, "MUL")
+        np.multiply(a.asArray(), _valuesLike(a, b), out=newMap.asArray())
         return newMap
     else:
         raise Exception("Cannot MUL Grids with different sizes")
 
 
-def scaleGrid(a: GridMap, scalar: float):
-    aValues = a.exportValues()
-    scaled = [aValues[i] * scalar for i in range(len(aValues))]
-    newMap = GridMap(a.width, a.height)
-    newMap.importValues(scaled)
+def scaleGrid(a: GridMap, scalar: float, out: GridMap = None):
+    newMap = _resultMap(a, scalar, out, "SCALE")
+    np.multiply(a.asArray(), scalar, out=newMap.asArray())
     return newMap
 
 
 def normalizeGridMaps(maps: dict) -> dict:
-    w = (list(maps.values()))[0].width
-    h = (list(maps.values()))[0].height
-    sumMap = GridMap(w, h)
-    for key in maps.keys():
-        sumMap = addGrids(sumMap, maps[key])
-
-    normalMaps = {}
-    for key in maps.keys():
-        normalMaps[key] = divGrids(maps[key], sumMap)
-    return normalMaps
+    return GridMapStack_fromGridMaps(maps).normalize().toGridMaps()
 
 
 def normalizeGridMapValues(m: GridMap) -> GridMap:
-    values = m.exportValues()
-    upper = max(values)
-    lower = min(values)
+    values = m.asArray()
+    upper = np.max(values)
+    lower = np.min(values)
     if (upper - lower) != 0:
-        normalValues = [(v - lower) / (upper - lower) for v in values]
+        normalValues = (values - lower) / (upper - lower)
     else:
-        normalValues = [0.0]*len(values)
-    newMap = GridMap(m.width, m.height)
-    newMap.importValues(normalValues)
-    return newMap
+        normalValues = np.zeros_like(values, dtype=np.float64)
+    return GridMap(m.width, m.height, normalValues)
@@ -1,9 +1,9 @@
 import itertools
-import math
-import multiprocessing
 import string
 
-from jahan.GridMap import GridMap, normalizeGridMaps, normalizeGridMapValues, mulGrids
+import numpy as np
+
+from jahan.GridMap import GridMap, GridMapStack
 
 NONE_ITEM_KEY = "NONE_ITEM"
 NONE_ITEM: dict = {NONE_ITEM_KEY: 4096}
@@ -16,6 +16,10 @@ def easeInOut(x: float):
         return 1 - ((-2 * x + 2) ** 2) / 2
 
 
+def easeInOutArray(x: np.ndarray) -> np.ndarray:
+    return np.where(x < 0.5, 2 * x * x, 1 - np.float_power(-2 * x + 2, 2) / 2)
+
+
 def generate_2d_mesh(mapWidth, mapHeight):
     ret = list(itertools.product(range(mapWidth), range(mapHeight)))
     ret = [(x, y) for y, x in ret]
@@ -23,9 +27,23 @@ def generate_2d_mesh(mapWidth, mapHeight):
 
 
 class LandscapeMapGenerator:
+    """
+    Generators whose landscape maps are some area independent bands times the influence of the area return those
+    bands from generateLandscapeBands, so areas sharing a generator can share the bands too. Other generators return
+    None there and only implement generateLandscapeMaps. Bands constant over the whole map are plain numbers.
+    Both methods are sparse: landscapes missing from the returned dict get no contribution at all.
+    """
+
     def __init__(self):
         pass
 
+    def generateLandscapeBands(self,
+                               width: int,
+                               height: int,
+                               landscapes: dict,
+                               heightMap: GridMap):
+        return None
+
     def generateLandscapeMaps(self,
                               areaName: string,
                               width: int,
@@ -33,7 +51,11 @@ class LandscapeMapGenerator:
                               landscapes: dict,
                               influenceMaps: dict,
                               heightMap: GridMap):
-        pass
+        bands = self.generateLandscapeBands(width, height, landscapes, heightMap)
+        if bands is None:
+            return None
+
+        return {landscapeName: band * influenceMaps[areaName] for landscapeName, band in bands.items()}
 
 
 class SingleProfileLandscapeGenerator(LandscapeMapGenerator):
@@ -41,20 +63,14 @@ class SingleProfileLandscapeGenerator(LandscapeMapGenerator):
         super().__init__()
         self.__desiredLandscapeName = desiredLandscapeName
 
-    def generateLandscapeMaps(self,
-                              areaName: string,
-                              width: int,
-                              height: int,
-                              landscapes: dict,
-                              influenceMaps: dict,
-                              heightMap: GridMap):
-        maps = {}
-        for landscapeName in landscapes.keys():
-            if landscapeName == self.__desiredLandscapeName:
-                maps[landscapeName] = influenceMaps[areaName]
-            else:
-                maps[landscapeName] = GridMap(width, height)
-        return maps
+    def generateLandscapeBands(self,
+                               width: int,
+                               height: int,
+                               landscapes: dict,
+                               heightMap: GridMap):
+        if self.__desiredLandscapeName not in landscapes:
+            return {}
+        return {self.__desiredLandscapeName: 1.0}
 
 
 # ===========================================
@@ -84,41 +100,28 @@ class HeightBasedLandscapeGenerator(LandscapeMapGenerator):
         super().__init__()
         self.__heightOrder = heightOrder
 
-    def generateLandscapeMaps(self,
-                              areaName: string,
-                              width: int,
-                              height: int,
-                              landscapes: dict,
-                              influenceMaps: dict,
-                              heightMap: GridMap):
-        landscape_maps = {}
-        pool = multiprocessing.Pool(processes=4)
-        pixelList = generate_2d_mesh(width, height)
-
+    def generateLandscapeBands(self,
+                               width: int,
+                               height: int,
+                               landscapes: dict,
+                               heightMap: GridMap):
         h_min = heightMap.valueMin
         h_range = heightMap.valueRange
 
-        areaInfluence = influenceMaps[areaName]
-
         desiredHeights = {}
         step: float = h_range / (len(self.__heightOrder) - 1)
         for i in range(len(self.__heightOrder)):
             landscapeName = self.__heightOrder[i]
             desiredHeights[landscapeName] = h_min + i * step
 
-        for landscapeName in landscapes.keys():
-            calcLandscapeInfluenceOnPixelByHeight_callable = \
-                calcLandscapeInfluenceOnPixelByHeight(heightMap, desiredHeights[landscapeName], step)
-
-            influence = list(pool.map(calcLandscapeInfluenceOnPixelByHeight_callable, pixelList))
-            landscape_maps[landscapeName] = GridMap(width, height)
-            landscape_maps[landscapeName].importValues(influence)
-
-        landscape_maps = normalizeGridMaps(landscape_maps)
+        # one (landscapes, h, w) pass over the height array for all bands
+        landscapeNames = list(landscapes.keys())
+        desired = np.array([desiredHeights[landscapeName] for landscapeName in landscapeNames])
+        diff = np.abs(heightMap.asArray()[np.newaxis] - desired[:, np.newaxis, np.newaxis])
+        norm = np.minimum(diff, step) / step
 
-        for landscapeName in landscape_maps.keys():
-            landscape_maps[landscapeName] = mulGrids(landscape_maps[landscapeName], areaInfluence)
-        return landscape_maps
+        bands = GridMapStack(landscapeNames, width, height, easeInOutArray(1 - norm))
+        return bands.normalize().toGridMaps()
 
 
 # ================ PROFILE ==================
@@ -2,9 +2,13 @@ import copy
 import math
 import string
 import networkx as nx
+import numpy as np
+import shapely
 from typing import List, Dict
 from jahan.VectorArithmetic import Vector2D, Segment2D, Vector2D_fromList
+from jahan.Tiling import MapTile, fullMapTile, boundingTileOfPoints
 from shapely.geometry import Point, Polygon
+from shapely.prepared import prep
 
 
 # ======================================================================================================================
@@ -111,11 +115,16 @@ class AreaPolygon:
     __cachedSuperCell = None
     __DirtyBorderSegments = True
     __cachedBorderSegments = None
+    __DirtyShape = True
+    __cachedShape = None
+    __cachedPreparedShape = None
+    __cachedDeepestPixelDistances = None
 
     def __init__(self, areaName: string):
         self.__areaName = areaName
         self.__canvasSeeds = []
         self.__canvasCells = []
+        self.__cachedDeepestPixelDistances = {}
 
     def __copy__(self):
         cp = AreaPolygon(self.areaName)
@@ -127,19 +136,30 @@ class AreaPolygon:
     def __deepcopy__(self, memodict={}):
         return self.__copy__()
 
+    def __getstate__(self):
+        # prepared geometries cannot be pickled, worker processes prepare their own
+        state = self.__dict__.copy()
+        state.pop("_AreaPolygon__cachedPreparedShape", None)
+        state["_AreaPolygon__DirtyShape"] = True
+        return state
+
+    def __invalidateGeometry(self):
+        self.__DirtySuperCell = True
+        self.__DirtyBorderSegments = True
+        self.__DirtyShape = True
+        self.__cachedDeepestPixelDistances = {}
+
     def addCell(self, seed: Vector2D, cell: List[Vector2D]):
         self.__canvasSeeds.append(seed)
         self.__canvasCells.append(cell)
-        self.__DirtySuperCell = True
-        self.__DirtyBorderSegments = True
+        self.__invalidateGeometry()
 
     def removeCell(self, seed: Vector2D):
         if seed in self.__canvasSeeds:
             index = self.__canvasSeeds.index(seed)
             self.__canvasSeeds.remove(seed)
             self.__canvasCells.remove(self.__canvasCells[index])
-            self.__DirtySuperCell = True
-            self.__DirtyBorderSegments = True
+            self.__invalidateGeometry()
 
     @property
     def areaName(self):
@@ -153,20 +173,27 @@ class AreaPolygon:
     def cells(self):
         return self.__canvasCells.copy()
 
+    def __extractBorderSegments(self) -> List[Segment2D]:
+        # segments shared by two cells are inner edges, the ones used only once make up the border
+        segments = []
+        for cell in self.__canvasCells:
+            size = len(cell)
+            for i in range(size):
+                segments.append(Segment2D(cell[i % size], cell[(i + 1) % size]))
+
+        counts = {}
+        for s in segments:
+            key = frozenset((s.start, s.end))
+            counts[key] = counts.get(key, 0) + 1
+
+        return [s for s in segments if counts[frozenset((s.start, s.end))] == 1]
+
     @property
     def borderSegments(self):
         if not self.__DirtyBorderSegments:
             return self.__cachedBorderSegments
         else:
-            cells = self.cells
-            segments = []
-            for cell in cells:
-                size = len(cell)
-                for i in range(size):
-                    segment = Segment2D(cell[i % size], cell[(i + 1) % size])
-                    segments.append(segment)
-
-            borderSegments = [s for s in segments if segments.count(s) == 1]
+            borderSegments = self.__extractBorderSegments()
             self.__DirtyBorderSegments = False
             self.__cachedBorderSegments = borderSegments
 
@@ -177,18 +204,16 @@ class AreaPolygon:
         if not self.__DirtySuperCell:
             return self.__cachedSuperCell
         else:
-            cells = self.cells
-            segments = []
-            for cell in cells:
-                size = len(cell)
-                for i in range(size):
-                    segment = Segment2D(cell[i % size], cell[(i + 1) % size])
-                    segments.append(segment)
+            borderSegments = self.__extractBorderSegments()
 
-            borderSegments = [s for s in segments if segments.count(s) == 1]
+            touching: Dict[Vector2D, list] = {}
+            for s in borderSegments:
+                touching.setdefault(s.start, []).append(s)
+                if s.end != s.start:
+                    touching.setdefault(s.end, []).append(s)
 
             def findContinueOrMeetSegment(target: Segment2D):
-                for s in borderSegments:
+                for s in touching.get(target.end, []):
                     if s != target:
                         if s.continues(target):
                             return s
@@ -205,6 +230,43 @@ class AreaPolygon:
             self.__cachedSuperCell = orderedSegments
             return orderedSegments
 
+    @property
+    def shape(self) -> Polygon:
+        if self.__DirtyShape:
+            self.__cachedShape = Polygon(self.superCellPointsAsList)
+            self.__cachedPreparedShape = prep(self.__cachedShape)
+            self.__DirtyShape = False
+        return self.__cachedShape
+
+    @property
+    def preparedShape(self):
+        self.shape
+        return self.__cachedPreparedShape
+
+    def signedDistances(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # distances of the points to the border, negative inside the polygon
+        shape = self.shape
+        absDist = shapely.distance(shape.exterior, shapely.points(xs, ys))
+        return np.where(shapely.intersects_xy(shape, xs, ys), -1 * absDist, absDist)
+
+    def deepestPixelDistance(self, mapWidth: int, mapHeight: int) -> float:
+        """
+        The largest distance from the center of a map pixel inside the polygon to its border. The deepest pixel lies
+        in the polygon's bounding box, which is measured once per map size in bands of rows to bound memory.
+        """
+        key = (mapWidth, mapHeight)
+        if key not in self.__cachedDeepestPixelDistances:
+            box = boundingTileOfPoints(self.superCellPointsAsList, mapWidth, mapHeight, 1)
+            if box.isEmpty:
+                box = fullMapTile(mapWidth, mapHeight)
+            rowsPerBand = max(2 ** 20 // box.width, 1)
+            minDist = np.inf
+            for y in range(box.y, box.y + box.height, rowsPerBand):
+                band = MapTile(box.x, y, box.width, min(rowsPerBand, box.y + box.height - y))
+                minDist = min(minDist, self.signedDistances(*band.pixelGrid()).min())
+            self.__cachedDeepestPixelDistances[key] = abs(minDist)
+        return self.__cachedDeepestPixelDistances[key]
+
     @property
     def centerOfMass(self):
         s = Vector2D(0, 0)
@@ -232,16 +294,13 @@ class AreaPolygon:
                 newCell.append(self.__canvasCells[i][j] * scale)
             self.__canvasCells[i] = newCell
 
-        self.__DirtySuperCell = True
-        self.__DirtyBorderSegments = True
+        self.__invalidateGeometry()
 
     def containsPoint(self, p: Vector2D) -> bool:
-        poly = Polygon(self.superCellPointsAsList)
-        return poly.contains(Point(p.asList)) or poly.intersects(Point(p.asList))
+        return self.preparedShape.intersects(Point(p.asList))
 
     def findDistanceToPoint(self, p: Vector2D) -> float:
-        poly = Polygon(self.superCellPointsAsList)
-        return abs(poly.exterior.distance(Point(p.asList)))
+        return abs(self.shape.exterior.distance(Point(p.asList)))
 
     def findDistanceToClosestBorderSegment(self, p: Vector2D) -> float:
         borderSegments = self.borderSegments
@@ -1,14 +1,119 @@
-import random as rnd
-from itertools import product
+from collections import OrderedDict
 from ctypes import c_int64
 import math
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from jahan.Tiling import MapTile, fullMapTile
 
 
 # ==================================================================================================================
 # MISC.
 # ==================================================================================================================
 
-rnd.seed(5)
+DEFAULT_NOISE_SEED = 5
+
+
+def generateNoiseSeed() -> int:
+    # a fresh seed from OS entropy, for generators that were not given one
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+class SeededNoise2D:
+    """
+    Base class of noise sources owning an explicit seed. All tables and random draws of a source derive from its
+    seed only, so sources never share state and identical seeds always give identical maps.
+    """
+
+    def __init__(self, seed: int = None):
+        if seed is None:
+            seed = generateNoiseSeed()
+        self.__seed = seed
+
+    @property
+    def seed(self) -> int:
+        return self.__seed
+
+    def newGenerator(self) -> np.random.Generator:
+        return np.random.default_rng(self.__seed)
+
+
+class NoiseMapCache:
+    """
+    Least recently used store of generated noise maps, bounded by the total bytes of the arrays it holds. Stored
+    arrays are read-only and never handed out, callers get writable copies of them.
+    """
+
+    def __init__(self, maxBytes: int = 256 * 2 ** 20):
+        self.__maxBytes = maxBytes
+        self.__bytes = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    @property
+    def maxBytes(self) -> int:
+        return self.__maxBytes
+
+    @maxBytes.setter
+    def maxBytes(self, value: int):
+        with self.__lock:
+            self.__maxBytes = value
+            self.__evict()
+
+    @property
+    def nbytes(self) -> int:
+        return self.__bytes
+
+    def get(self, key, window=None):
+        # a writable copy of the stored array, or of its part selected by the 'window' index
+        with self.__lock:
+            values = self.__entries.get(key)
+            if values is None:
+                return None
+            self.__entries.move_to_end(key)
+        return np.array(values if window is None else values[window])
+
+    def put(self, key, values: np.ndarray) -> bool:
+        # the cache takes 'values' over, so arrays are only stored and made read-only when they fit
+        with self.__lock:
+            if values.nbytes > self.__maxBytes:
+                return False
+            values.flags.writeable = False
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key).nbytes
+            self.__entries[key] = values
+            self.__bytes += values.nbytes
+            self.__evict()
+        return True
+
+    def getOrGenerate(self, key, generate, window=None) -> np.ndarray:
+        values = self.get(key, window)
+        if values is None:
+            values = np.asarray(generate())
+            if self.put(key, values):
+                values = np.array(values if window is None else values[window])
+            elif window is not None:
+                values = values[window]
+        return values
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def __evict(self):
+        while self.__bytes > self.__maxBytes and self.__entries:
+            self.__bytes -= self.__entries.popitem(last=False)[1].nbytes
+
+
+NOISE_MAP_CACHE = NoiseMapCache()
+
 
 def easeInOut(x):
     return x * x * (3.0 - (2.0 * x))
@@ -26,6 +131,15 @@ def integerOverflow(x):
 # FRACTAL NOISE ALGORITHMS
 # ==================================================================================================================
 
+def noiseGridCoordinates(width: int, height: int, scale=8, tile: MapTile = None):
+    # row i of the map samples x = i / height * scale, column j samples y = j / width * scale
+    # a tile only samples its own rows and columns, but still in the coordinates of the whole map
+    if tile is None:
+        tile = fullMapTile(width, height)
+    j, i = tile.pixelGrid()
+    return i / height * scale, j / width * scale
+
+
 def fBm(baseNoiseGenerator, point, octaves=4, persistence=0.5, ):
     x = point[0]
     y = point[1]
@@ -51,59 +165,91 @@ def fBm(baseNoiseGenerator, point, octaves=4, persistence=0.5, ):
 # WHITE NOISE
 # ======================================================================================================================
 
-def whiteNoise(width: int, height: int, amplitude=1):
-    return [rnd.uniform(-1.0, 1.0) * amplitude for _ in range(width * height)]
+class WhiteNoise2D(SeededNoise2D):
+    def generate(self, width: int, height: int, amplitude=1, tile: MapTile = None):
+        # every row has its own stream, so a tile draws the same values as the whole map does
+        if tile is None:
+            tile = fullMapTile(width, height)
+        rows = [np.random.default_rng([self.seed, y]).uniform(-1.0, 1.0, width)[tile.x:tile.x + tile.width]
+                for y in range(tile.y, tile.y + tile.height)]
+        return np.concatenate(rows) * amplitude if rows else np.zeros(0)
+
+
+def whiteNoise(width: int, height: int, amplitude=1, seed: int = None):
+    return WhiteNoise2D(seed).generate(width, height, amplitude)
 
 
 # ======================================================================================================================
 # PERLIN NOISE
 # ======================================================================================================================
 
-PERLIN_GRAD_DATA = {}
 PERLIN_SCALE_FACTOR = 2 / math.sqrt(2)
+PERLIN_LATTICE_SIZE = 256
+
+
+def generatePerlinGradientLattice(seed=0, size=PERLIN_LATTICE_SIZE):
+    # normalized gaussian vectors, i.e. unit gradients with uniformly distributed directions
+    generator = np.random.default_rng(seed)
+    vectors = generator.standard_normal((size, size, 2))
+    return vectors / np.linalg.norm(vectors, axis=2, keepdims=True)
+
+
+PERLIN_GRAD_LATTICE = generatePerlinGradientLattice(seed=DEFAULT_NOISE_SEED)
+
+
+def batchPerlinNoise(p, lattice=None):
+    """
+    Evaluates perlin noise for whole arrays of coordinates at once, p being a pair (x, y) of equally shaped arrays.
+    Gradients are read from a square lattice which repeats itself every 'size' units.
+    """
+    if lattice is None:
+        lattice = PERLIN_GRAD_LATTICE
+    size = lattice.shape[0]
+
+    x = np.asarray(p[0], dtype=np.float64)
+    y = np.asarray(p[1], dtype=np.float64)
+    min_x = np.floor(x)
+    min_y = np.floor(y)
+    dx = x - min_x
+    dy = y - min_y
+
+    x0 = min_x.astype(np.int64) % size
+    y0 = min_y.astype(np.int64) % size
+    x1 = (x0 + 1) % size
+    y1 = (y0 + 1) % size
+
+    def dot(grid_x, grid_y, offset_x, offset_y):
+        gradient = lattice[grid_x, grid_y]
+        return gradient[..., 0] * offset_x + gradient[..., 1] * offset_y
+
+    s = easeInOut(dy)
+    near = linearInterpolation(s, dot(x0, y0, dx, dy), dot(x0, y1, dx, dy - 1))
+    far = linearInterpolation(s, dot(x1, y0, dx - 1, dy), dot(x1, y1, dx - 1, dy - 1))
+
+    return linearInterpolation(easeInOut(dx), near, far) * PERLIN_SCALE_FACTOR
 
 
 def basicPerlinNoise(p):
-    grid_coords = []
-    for coord in p:
-        min_coord = math.floor(coord)
-        max_coord = min_coord + 1
-        grid_coords.append((min_coord, max_coord))
-
-    def generateRandomGradient():
-        vector = [rnd.gauss(0, 1), rnd.gauss(0, 1)]
-        scale = 1 / math.sqrt(vector[0] * vector[0] + vector[1] * vector[1])
-        return vector[0] * scale, vector[1] * scale
-
-    dots = []
-    for grid_point in product(*grid_coords):
-        if grid_point not in PERLIN_GRAD_DATA:
-            PERLIN_GRAD_DATA[grid_point] = generateRandomGradient()
-        gradient = PERLIN_GRAD_DATA[grid_point]
-
-        dot = gradient[0] * (p[0] - grid_point[0]) + gradient[1] * (p[1] - grid_point[1])
-        dots.append(dot)
-
-    dim = 2
-    while len(dots) > 1:
-        dim -= 1
-        s = easeInOut(p[dim] - grid_coords[dim][0])
-        next_dots = []
-        while dots:
-            next_dots.append(linearInterpolation(s, dots.pop(0), dots.pop(0)))
-        dots = next_dots
-
-    return dots[0] * PERLIN_SCALE_FACTOR
-
-
-def perlinNoise(width: int, height: int, amplitude=1, scale=8, octaves=4):
-    noise = [0.0] * height * width
-    for i in range(height):
-        for j in range(width):
-            p = (i / height * scale, j / width * scale)
-            value = fBm(baseNoiseGenerator=basicPerlinNoise, point=p, octaves=octaves, persistence=0.5)
-            noise[i * width + j] = value * amplitude
-    return noise
+    return float(batchPerlinNoise(p))
+
+
+def perlinNoise(width: int, height: int, amplitude=1, scale=8, octaves=4, lattice=None, tile: MapTile = None):
+    p = noiseGridCoordinates(width, height, scale, tile)
+    noise = fBm(baseNoiseGenerator=lambda point: batchPerlinNoise(point, lattice),
+                point=p, octaves=octaves, persistence=0.5)
+    return (noise * amplitude).ravel()
+
+
+class PerlinNoise2D(SeededNoise2D):
+    def __init__(self, seed: int = None):
+        super().__init__(seed)
+        self.__lattice = generatePerlinGradientLattice(self.seed)
+
+    def evaluate(self, p):
+        return batchPerlinNoise(p, self.__lattice)
+
+    def generate(self, width: int, height: int, amplitude=1, scale=8, octaves=4, tile: MapTile = None):
+        return perlinNoise(width, height, amplitude, scale, octaves, self.__lattice, tile)
 
 
 # ======================================================================================================================
@@ -139,7 +285,7 @@ def generatePermutationForOpenSimplex(seed=0):
     return perm
 
 
-OPEN_SIMPLEX_GRAD_PERM = generatePermutationForOpenSimplex(seed=rnd.randint(0, 1024))
+OPEN_SIMPLEX_GRAD_PERM = generatePermutationForOpenSimplex(seed=DEFAULT_NOISE_SEED)
 
 
 def openSimplex_extrapolate(xsb, ysb, dx, dy):
@@ -251,14 +397,127 @@ def basicOpenSimplexNoise(point):
     return value / OPEN_SIMPLEX_NORM
 
 
-def openSimplexNoise(width: int, height: int, amplitude=1, scale=8, octaves=4):
-    noise = [0.0] * height * width
-    for i in range(height):
-        for j in range(width):
-            p = (i / height * scale, j / width * scale)
-            value = fBm(baseNoiseGenerator=basicOpenSimplexNoise, point=p, octaves=octaves, persistence=0.5)
-            noise[i * width + j] = value * amplitude
-    return noise
+OPEN_SIMPLEX_GRADS_ARRAY = np.array(OPEN_SIMPLEX_GRADS, dtype=np.int64)
+
+
+def batchOpenSimplex_extrapolate(perm, xsb, ysb, dx, dy):
+    index = perm[(perm[xsb & 0xFF] + ysb) & 0xFF] & 0x0E
+    return OPEN_SIMPLEX_GRADS_ARRAY[index] * dx + OPEN_SIMPLEX_GRADS_ARRAY[index + 1] * dy
+
+
+def batchOpenSimplexNoise(point, perm=None):
+    """
+    Array version of basicOpenSimplexNoise. The region branches become masks and the permutation lookups become
+    array gathers, while every arithmetic step is kept in the same order so the values are bit-identical.
+    """
+    if perm is None:
+        perm = OPEN_SIMPLEX_GRAD_PERM
+    perm = np.asarray(perm, dtype=np.int64)
+
+    x = np.asarray(point[0], dtype=np.float64)
+    y = np.asarray(point[1], dtype=np.float64)
+
+    # Place input coordinates onto grid.
+    stretch_offset = (x + y) * OPEN_SIMPLEX_STRETCH
+    xs = x + stretch_offset
+    ys = y + stretch_offset
+
+    # Floor to get grid coordinates of rhombus (stretched square) super-cell origin.
+    xsb = np.floor(xs)
+    ysb = np.floor(ys)
+
+    # Skew out to get actual coordinates of rhombus origin.
+    squish_offset = (xsb + ysb) * OPEN_SIMPLEX_SQUISH
+    xb = xsb + squish_offset
+    yb = ysb + squish_offset
+
+    # Compute grid coordinates relative to rhombus origin.
+    xins = xs - xsb
+    yins = ys - ysb
+
+    # Sum those together to get a value that determines which region we're in.
+    in_sum = xins + yins
+
+    # Positions relative to origin point.
+    dx0 = x - xb
+    dy0 = y - yb
+
+    xsb = xsb.astype(np.int64)
+    ysb = ysb.astype(np.int64)
+
+    value = np.zeros_like(x)
+
+    def contribution(xsv, ysv, dx, dy):
+        attn = 2 - dx * dx - dy * dy
+        attn_squared = attn * attn
+        return np.where(attn > 0, attn_squared * attn_squared * batchOpenSimplex_extrapolate(perm, xsv, ysv, dx, dy), 0.0)
+
+    # Contribution (1,0)
+    value += contribution(xsb + 1, ysb + 0, dx0 - 1 - OPEN_SIMPLEX_SQUISH, dy0 - 0 - OPEN_SIMPLEX_SQUISH)
+
+    # Contribution (0,1)
+    value += contribution(xsb + 0, ysb + 1, dx0 - 0 - OPEN_SIMPLEX_SQUISH, dy0 - 1 - OPEN_SIMPLEX_SQUISH)
+
+    inner = in_sum <= 1  # inside the triangle (2-Simplex) at (0,0), otherwise at (1,1)
+    x_greater = xins > yins
+    inner_zins = 1 - in_sum
+    outer_zins = 2 - in_sum
+    regions = [
+        # (0,0) is one of the closest two triangular vertices
+        inner & ((inner_zins > xins) | (inner_zins > yins)) & x_greater,
+        inner & ((inner_zins > xins) | (inner_zins > yins)) & ~x_greater,
+        # (1,0) and (0,1) are the closest two vertices.
+        inner,
+        # (0,0) is one of the closest two triangular vertices
+        ~inner & ((outer_zins < xins) | (outer_zins < yins)) & x_greater,
+        ~inner & ((outer_zins < xins) | (outer_zins < yins)) & ~x_greater,
+    ]
+    # the remaining points are outside with (1,0) and (0,1) being the closest two vertices.
+    xsv_ext = np.select(regions, [xsb + 1, xsb - 1, xsb + 1, xsb + 2, xsb + 0], xsb)
+    ysv_ext = np.select(regions, [ysb - 1, ysb + 1, ysb + 1, ysb + 0, ysb + 2], ysb)
+    dx_ext = np.select(regions, [dx0 - 1,
+                                 dx0 + 1,
+                                 dx0 - 1 - 2 * OPEN_SIMPLEX_SQUISH,
+                                 dx0 - 2 - 2 * OPEN_SIMPLEX_SQUISH,
+                                 dx0 + 0 - 2 * OPEN_SIMPLEX_SQUISH], dx0)
+    dy_ext = np.select(regions, [dy0 + 1,
+                                 dy0 - 1,
+                                 dy0 - 1 - 2 * OPEN_SIMPLEX_SQUISH,
+                                 dy0 + 0 - 2 * OPEN_SIMPLEX_SQUISH,
+                                 dy0 - 2 - 2 * OPEN_SIMPLEX_SQUISH], dy0)
+
+    # points in the (1,1) triangle are measured from the opposite corner of the rhombus
+    xsb = np.where(inner, xsb, xsb + 1)
+    ysb = np.where(inner, ysb, ysb + 1)
+    dx0 = np.where(inner, dx0, dx0 - 1 - 2 * OPEN_SIMPLEX_SQUISH)
+    dy0 = np.where(inner, dy0, dy0 - 1 - 2 * OPEN_SIMPLEX_SQUISH)
+
+    # Contribution (0,0) or (1,1)
+    value += contribution(xsb, ysb, dx0, dy0)
+
+    # Extra Vertex
+    value += contribution(xsv_ext, ysv_ext, dx_ext, dy_ext)
+
+    return value / OPEN_SIMPLEX_NORM
+
+
+def openSimplexNoise(width: int, height: int, amplitude=1, scale=8, octaves=4, perm=None, tile: MapTile = None):
+    p = noiseGridCoordinates(width, height, scale, tile)
+    noise = fBm(baseNoiseGenerator=lambda point: batchOpenSimplexNoise(point, perm),
+                point=p, octaves=octaves, persistence=0.5)
+    return (noise * amplitude).ravel()
+
+
+class OpenSimplexNoise2D(SeededNoise2D):
+    def __init__(self, seed: int = None):
+        super().__init__(seed)
+        self.__perm = np.array(generatePermutationForOpenSimplex(self.seed), dtype=np.int64)
+
+    def evaluate(self, p):
+        return batchOpenSimplexNoise(p, self.__perm)
+
+    def generate(self, width: int, height: int, amplitude=1, scale=8, octaves=4, tile: MapTile = None):
+        return openSimplexNoise(width, height, amplitude, scale, octaves, self.__perm, tile)
 
 
 # ======================================================================================================================
@@ -266,23 +525,80 @@ def openSimplexNoise(width: int, height: int, amplitude=1, scale=8, octaves=4):
 # ======================================================================================================================
 
 
-def worleyNoise(width: int, height: int, amplitude=1, seedCount=100):
-    noiseValues = [0.0] * width * height
-    seedsX = [rnd.randint(0, width - 1) for _ in range(seedCount)]
-    seedsY = [rnd.randint(0, height - 1) for _ in range(seedCount)]
+WORLEY_F1 = "F1"
+WORLEY_F2 = "F2"
+WORLEY_F2_MINUS_F1 = "F2-F1"
+
+
+def worleyDistances(tree: cKDTree, seedCount: int, feature, tile: MapTile):
+    xs, ys = tile.pixelGrid()
+    pixels = np.column_stack((xs.ravel(), ys.ravel()))
+
+    if feature == WORLEY_F1:
+        distances, _ = tree.query(pixels, k=1)
+        return distances
+    elif feature in (WORLEY_F2, WORLEY_F2_MINUS_F1):
+        if seedCount < 2:
+            raise Exception("Worley feature {F} needs at least two seeds".format(F=feature))
+        nearest, _ = tree.query(pixels, k=2)
+        if feature == WORLEY_F2:
+            return nearest[:, 1]
+        else:
+            return nearest[:, 1] - nearest[:, 0]
+    else:
+        raise Exception("Unknown worley feature: {F}".format(F=feature))
+
 
+def worleyMaxDistance(tree: cKDTree, seedCount: int, feature, width: int, height: int, rowsPerBlock: int = 256):
+    # largest distance over the whole map, measured a few rows at a time to keep memory bounded
     maxDistance = 0.0
-    for y in range(height):
-        for x in range(width):
-            distances = [math.hypot(seedsX[i] - x, seedsY[i] - y) for i in range(seedCount)]
-            distances.sort()
-            if distances[0] > maxDistance:
-                maxDistance = distances[0]
-
-    for y in range(height):
-        for x in range(width):
-            distances = [math.hypot(seedsX[i] - x, seedsY[i] - y) for i in range(seedCount)]
-            distances.sort()
-            noiseValues[y * height + x] = amplitude * (1 - distances[0] / maxDistance)
-
-    return noiseValues
+    for y in range(0, height, rowsPerBlock):
+        block = MapTile(0, y, width, min(rowsPerBlock, height - y))
+        maxDistance = max(maxDistance, np.max(worleyDistances(tree, seedCount, feature, block)))
+    return maxDistance
+
+
+def worleyNoiseFromSeeds(width: int, height: int, seedsX, seedsY, amplitude=1, feature=WORLEY_F1,
+                         tile: MapTile = None, maxDistance: float = None):
+    seedCount = len(seedsX)
+    tree = cKDTree(np.column_stack((seedsX, seedsY)))
+
+    if tile is None:
+        distances = worleyDistances(tree, seedCount, feature, fullMapTile(width, height))
+        if maxDistance is None:
+            maxDistance = np.max(distances)
+    else:
+        distances = worleyDistances(tree, seedCount, feature, tile)
+        if maxDistance is None:
+            maxDistance = worleyMaxDistance(tree, seedCount, feature, width, height)
+
+    if maxDistance == 0.0:
+        return np.full(len(distances), float(amplitude))
+    return amplitude * (1 - distances / maxDistance)
+
+
+class WorleyNoise2D(SeededNoise2D):
+    def __init__(self, seed: int = None):
+        super().__init__(seed)
+        self.__maxDistances = {}
+
+    def generate(self, width: int, height: int, amplitude=1, seedCount=100, feature=WORLEY_F1,
+                 tile: MapTile = None):
+        generator = self.newGenerator()
+        seedsX = generator.integers(0, width, seedCount)
+        seedsY = generator.integers(0, height, seedCount)
+
+        # tiles are normalized by the maximum of the whole map, which is measured once per map size
+        maxDistance = None
+        if tile is not None:
+            key = (width, height, seedCount, feature)
+            if key not in self.__maxDistances:
+                tree = cKDTree(np.column_stack((seedsX, seedsY)))
+                self.__maxDistances[key] = worleyMaxDistance(tree, seedCount, feature, width, height)
+            maxDistance = self.__maxDistances[key]
+
+        return worleyNoiseFromSeeds(width, height, seedsX, seedsY, amplitude, feature, tile, maxDistance)
+
+
+def worleyNoise(width: int, height: int, amplitude=1, seedCount=100, feature=WORLEY_F1, seed: int = None):
+    return WorleyNoise2D(seed).generate(width, height, amplitude, seedCount, feature)
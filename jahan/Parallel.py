@@ -0,0 +1,102 @@
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+PROCESS_EXECUTOR = "process"
+THREAD_EXECUTOR = "thread"
+SERIAL_EXECUTOR = "serial"
+
+
+# ======================================================================================================================
+# Pipeline Executor
+# ======================================================================================================================
+
+class PipelineExecutor:
+    """
+    Maps work over a pool of workers that is created on first use and reused by every pipeline stage until the
+    executor is closed. 'process' suits pure Python per-pixel work, 'thread' suits NumPy kernels that release the GIL
+    and 'serial' runs everything in the calling thread.
+    """
+
+    def __init__(self, kind: str = PROCESS_EXECUTOR, workers: int = None):
+        if kind not in (PROCESS_EXECUTOR, THREAD_EXECUTOR, SERIAL_EXECUTOR):
+            raise Exception("Unknown executor kind: {K}".format(K=kind))
+        self.__kind = kind
+        self.__workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def kind(self) -> str:
+        return self.__kind
+
+    @property
+    def workers(self) -> int:
+        return self.__workers
+
+    def map(self, func, iterable) -> list:
+        if self.__kind == SERIAL_EXECUTOR or self.__workers <= 1:
+            return list(map(func, iterable))
+
+        if self.__pool is None:
+            if self.__kind == PROCESS_EXECUTOR:
+                self.__pool = multiprocessing.Pool(processes=self.__workers)
+            else:
+                self.__pool = ThreadPoolExecutor(max_workers=self.__workers)
+
+        if self.__kind == PROCESS_EXECUTOR:
+            return self.__pool.map(func, iterable)
+        else:
+            return list(self.__pool.map(func, iterable))
+
+    def close(self):
+        if self.__pool is not None:
+            if self.__kind == PROCESS_EXECUTOR:
+                self.__pool.close()
+                self.__pool.join()
+            else:
+                self.__pool.shutdown()
+            self.__pool = None
+
+
+# ======================================================================================================================
+# Default Executor
+# ======================================================================================================================
+
+DEFAULT_EXECUTOR: PipelineExecutor = None
+
+
+def setDefaultExecutor(executor: PipelineExecutor):
+    """
+    Sets the executor used by pipeline stages that are not given one explicitly.
+    The previous default is closed unless it is the same object.
+    """
+    global DEFAULT_EXECUTOR
+    if DEFAULT_EXECUTOR is not None and DEFAULT_EXECUTOR is not executor:
+        DEFAULT_EXECUTOR.close()
+    DEFAULT_EXECUTOR = executor
+
+
+def getDefaultExecutor() -> PipelineExecutor:
+    global DEFAULT_EXECUTOR
+    if DEFAULT_EXECUTOR is None:
+        DEFAULT_EXECUTOR = PipelineExecutor()
+    return DEFAULT_EXECUTOR
+
+
+def resolveExecutor(executor: PipelineExecutor = None) -> PipelineExecutor:
+    return executor if executor is not None else getDefaultExecutor()
+
+
+def __closeDefaultExecutor():
+    if DEFAULT_EXECUTOR is not None:
+        DEFAULT_EXECUTOR.close()
+
+
+atexit.register(__closeDefaultExecutor)
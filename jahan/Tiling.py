@@ -0,0 +1,156 @@
+import numpy as np
+
+from jahan.GridMap import GridMap, GridMapStack
+
+
+# ======================================================================================================================
+# Map Tiles
+# ======================================================================================================================
+
+class MapTile:
+    """
+    A rectangular window of pixels on a map, given in world pixel coordinates.
+    """
+
+    def __init__(self, x: int, y: int, width: int, height: int):
+        self.__x = int(x)
+        self.__y = int(y)
+        self.__width = max(int(width), 0)
+        self.__height = max(int(height), 0)
+
+    def __key(self):
+        return self.__x, self.__y, self.__width, self.__height
+
+    def __eq__(self, other):
+        if isinstance(other, MapTile):
+            return self.__key() == other.__key()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    def __str__(self):
+        return "[{X},{Y} {W}x{H}]".format(X=self.__x, Y=self.__y, W=self.__width, H=self.__height)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.__width * self.__height
+
+    @property
+    def x(self) -> int:
+        return self.__x
+
+    @property
+    def y(self) -> int:
+        return self.__y
+
+    @property
+    def width(self) -> int:
+        return self.__width
+
+    @property
+    def height(self) -> int:
+        return self.__height
+
+    @property
+    def isEmpty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def slices(self):
+        # index of this tile in a (height, width) map array
+        return slice(self.__y, self.__y + self.__height), slice(self.__x, self.__x + self.__width)
+
+    def slicesIn(self, other):
+        # index of this tile in the array of another tile containing it
+        return slice(self.__y - other.y, self.__y - other.y + self.__height), \
+               slice(self.__x - other.x, self.__x - other.x + self.__width)
+
+    def pixelGrid(self):
+        # x and y coordinates of every pixel, each as a (height, width) array
+        ys, xs = np.mgrid[self.__y:self.__y + self.__height, self.__x:self.__x + self.__width]
+        return xs, ys
+
+    def pixelList(self) -> list:
+        # pixels row by row, in the same order as generate_2d_mesh
+        return [(x, y) for y in range(self.__y, self.__y + self.__height)
+                for x in range(self.__x, self.__x + self.__width)]
+
+    def clipped(self, mapWidth: int, mapHeight: int):
+        x0 = min(max(self.__x, 0), mapWidth)
+        y0 = min(max(self.__y, 0), mapHeight)
+        x1 = min(max(self.__x + self.__width, 0), mapWidth)
+        y1 = min(max(self.__y + self.__height, 0), mapHeight)
+        return MapTile(x0, y0, x1 - x0, y1 - y0)
+
+    def intersection(self, other):
+        x0 = max(self.__x, other.x)
+        y0 = max(self.__y, other.y)
+        x1 = min(self.__x + self.__width, other.x + other.width)
+        y1 = min(self.__y + self.__height, other.y + other.height)
+        return MapTile(x0, y0, x1 - x0, y1 - y0)
+
+    def dilated(self, radius: int, mapWidth: int, mapHeight: int):
+        return MapTile(self.__x - radius,
+                       self.__y - radius,
+                       self.__width + 2 * radius,
+                       self.__height + 2 * radius).clipped(mapWidth, mapHeight)
+
+
+def fullMapTile(mapWidth: int, mapHeight: int) -> MapTile:
+    return MapTile(0, 0, mapWidth, mapHeight)
+
+
+def boundingTileOfPoints(points: list, mapWidth: int, mapHeight: int, radius: int = 0) -> MapTile:
+    """
+    The smallest tile holding every given [x, y] pixel position, dilated by 'radius' and clipped to the map.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return MapTile(0, 0, 0, 0)
+    x0, y0 = np.floor(points.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(points.max(axis=0)).astype(int)
+    return MapTile(x0, y0, x1 - x0 + 1, y1 - y0 + 1).dilated(radius, mapWidth, mapHeight)
+
+
+def nonzeroTile(values: np.ndarray, tile: MapTile) -> MapTile:
+    """
+    The smallest tile holding every non-zero pixel of a (height, width) array that covers 'tile'.
+    """
+    rows = np.flatnonzero(np.any(values, axis=1))
+    cols = np.flatnonzero(np.any(values, axis=0))
+    if len(rows) == 0:
+        return MapTile(tile.x, tile.y, 0, 0)
+    return MapTile(tile.x + cols[0], tile.y + rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1)
+
+
+def splitIntoTiles(mapWidth: int, mapHeight: int, tileSize: int) -> list:
+    tiles = []
+    for y in range(0, mapHeight, tileSize):
+        for x in range(0, mapWidth, tileSize):
+            tiles.append(MapTile(x, y, min(tileSize, mapWidth - x), min(tileSize, mapHeight - y)))
+    return tiles
+
+
+# ======================================================================================================================
+# Disk-backed maps
+# ======================================================================================================================
+
+def openDiskGridMap(path: str, mapWidth: int, mapHeight: int, dtype=np.float32) -> GridMap:
+    """
+    Creates a GridMap whose values live in a .npy file on disk, so tiles can be streamed into maps larger than memory.
+    """
+    values = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(mapHeight, mapWidth))
+    return GridMap(mapWidth, mapHeight, values, dtype)
+
+
+def openDiskGridMapStack(path: str, names: list, mapWidth: int, mapHeight: int, dtype=np.float32) -> GridMapStack:
+    values = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(names), mapHeight, mapWidth))
+    return GridMapStack(names, mapWidth, mapHeight, values, dtype)
+
+
+def loadDiskGridMap(path: str) -> GridMap:
+    values = np.load(path, mmap_mode="r")
+    return GridMap(values.shape[1], values.shape[0], values, values.dtype)
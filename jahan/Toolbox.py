@@ -1,10 +1,15 @@
-import multiprocessing
+import os
+
+import shapely
+from scipy.ndimage import distance_transform_edt
 
 from jahan.Layout import *
 from jahan.GridMap import *
 from jahan.Canvas import *
 from jahan.Noise2D import *
-from jahan.VectorArithmetic import Vector2D
+from jahan.Tiling import *
+from jahan.Parallel import *
+from jahan.VectorArithmetic import Vector2D, Vector2D_fromList
 
 # ======================================================================================================================
 # General Stuff
@@ -12,6 +17,9 @@ from jahan.VectorArithmetic import Vector2D
 
 EMPTY_POLY = "EMPTY_POLYGON"
 
+INFLUENCE_EXACT = "exact"
+INFLUENCE_EDT = "edt"
+
 DESIRED_HEIGHT: int = 0
 FADE_RADIUS: int = 1
 
@@ -23,6 +31,10 @@ def easeInOut(x: float):
         return 1 - ((-2 * x + 2) ** 2) / 2
 
 
+def easeInOutArray(x: np.ndarray) -> np.ndarray:
+    return np.where(x < 0.5, 2 * x * x, 1 - ((-2 * x + 2) ** 2) / 2)
+
+
 def generate_2d_mesh(mapWidth, mapHeight):
     ret = list(itertools.product(range(mapWidth), range(mapHeight)))
     ret = [(x, y) for y, x in ret]
@@ -47,20 +59,64 @@ class findContainingAreaForPixel(object):
         return p, container
 
 
+def areaLabelNames(polygons: dict) -> list:
+    # label i of an area label map stands for areaLabelNames(...)[i], pixels outside every area get EMPTY_POLY
+    names = list(polygons.keys())
+    if EMPTY_POLY not in names:
+        names.append(EMPTY_POLY)
+    return names
+
+
+def rasterizeAreaPolygons(scaledPolygons: dict, tile: MapTile) -> GridMap:
+    """
+    Integer label map of the pixels of a tile, holding the index in areaLabelNames of the area containing each pixel.
+    Every polygon is rasterized once over its own bounding box. Like findContainingAreaForPixel, pixels on a border
+    belong to the first area containing them and the empty polygon is never tested.
+    """
+    names = areaLabelNames(scaledPolygons)
+    emptyLabel = names.index(EMPTY_POLY)
+    labels = np.full((tile.height, tile.width), emptyLabel, dtype=np.int32)
+
+    for label, areaName in enumerate(names):
+        if areaName == EMPTY_POLY:
+            continue
+
+        outline = scaledPolygons[areaName].superCellPointsAsList
+        box = boundingTileOfPoints(outline, tile.x + tile.width, tile.y + tile.height).intersection(tile)
+        if box.isEmpty:
+            continue
+
+        xs, ys = box.pixelGrid()
+        inside = shapely.intersects_xy(scaledPolygons[areaName].shape, xs, ys)
+        window = labels[box.slicesIn(tile)]
+        window[inside & (window == emptyLabel)] = label
+
+    return GridMap(tile.width, tile.height, labels, np.int32)
+
+
+def generateAreaLabelMap(polygons: dict, mapWidth: int, mapHeight: int) -> GridMap:
+    polygons = copy.deepcopy(polygons)
+    for area in polygons.keys():
+        polygons[area].scalePolygon(mapWidth, mapHeight)
+    return rasterizeAreaPolygons(polygons, fullMapTile(mapWidth, mapHeight))
+
+
 # ======================================================================================================================
 # Polygon Influence
 # ======================================================================================================================
 
 class calcPolygonInfluenceOnPixel(object):
-    def __init__(self, areaName: string, polygons: dict, areaOfPixels, fadeRadius: float = 0.075):
+    def __init__(self, areaName: string, polygons: dict, areaLabels: GridMap, tile: MapTile,
+                 fadeRadius: float = 0.075):
         self.areaName = areaName
         self.polygon = polygons[areaName]
-        self.polygons = polygons
-        self.areaOfPixels = areaOfPixels
+        self.areaLabel = areaLabelNames(polygons).index(areaName)
+        self.areaLabels = areaLabels
+        self.tile = tile
         self.fadeRadius = fadeRadius
 
     def __call__(self, p):
-        areaOfPixel = self.areaOfPixels[p]
+        isInArea = self.areaLabels.getValue(p[0] - self.tile.x, p[1] - self.tile.y) == self.areaLabel
         pixel = Vector2D(p[0], p[1])
 
         if self.areaName == EMPTY_POLY:
@@ -68,7 +124,7 @@ class calcPolygonInfluenceOnPixel(object):
         else:
             dist = self.polygon.findDistanceToPoint(pixel)
 
-        if areaOfPixel == self.areaName:
+        if isInArea:
             blendValue = 0.5 + 0.5 * min(dist, self.fadeRadius) / self.fadeRadius
         else:
             blendValue = 0.5 - 0.5 * min(dist, self.fadeRadius) / self.fadeRadius
@@ -76,34 +132,96 @@ class calcPolygonInfluenceOnPixel(object):
         return easeInOut(blendValue)
 
 
-def generateAreaInfluenceMapFromPolygons(polygons: dict, fadeRadius: float, mapWidth: int, mapHeight: int) -> dict:
-    polygons = copy.deepcopy(polygons)
-    for area in polygons.keys():
-        polygons[area].scalePolygon(mapWidth, mapHeight)
+def calcAreaInfluenceFromLabels(areaLabels: np.ndarray, label: int, fadeRadius: float) -> np.ndarray:
+    """
+    Distance transform counterpart of calcPolygonInfluenceOnPixel for a whole label raster. Distances to the area
+    border are measured between pixel centers with an exact EDT, half a pixel being the border itself.
+    """
+    mask = areaLabels == label
+    influence = np.zeros(mask.shape)
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return influence
+
+    # pixels farther than the fade radius from the area have no influence, so the EDT only covers its surroundings
+    margin = int(math.ceil(fadeRadius)) + 1
+    window = (slice(max(rows[0] - margin, 0), rows[-1] + margin + 1),
+              slice(max(cols[0] - margin, 0), cols[-1] + margin + 1))
+    inside = mask[window]
 
+    if inside.all():
+        insideDistance = np.full(inside.shape, np.inf)
+    else:
+        insideDistance = distance_transform_edt(inside) - 0.5
+    outsideDistance = distance_transform_edt(~inside) - 0.5
+
+    blendValue = np.where(inside,
+                          0.5 + 0.5 * np.minimum(insideDistance, fadeRadius) / fadeRadius,
+                          0.5 - 0.5 * np.minimum(outsideDistance, fadeRadius) / fadeRadius)
+    influence[window] = easeInOutArray(blendValue)
+    return influence
+
+
+def generateAreaInfluenceTile(scaledPolygons: dict,
+                              fadeRadius: float,
+                              tile: MapTile,
+                              executor: PipelineExecutor = None,
+                              method: string = INFLUENCE_EXACT) -> dict:
+    """
+    Normalized influence of every area on the pixels of one tile. Polygons must already be scaled to the map and
+    'fadeRadius' is given in pixels. INFLUENCE_EXACT measures distances to the polygons pixel by pixel, while
+    INFLUENCE_EDT derives them from the label raster with distance transforms. The EDT only sees the tile, so a
+    tile of a larger map needs a halo of at least the fade radius around it.
+    """
+    areaLabels = rasterizeAreaPolygons(scaledPolygons, tile)
     maps: Dict[string, GridMap] = {}
-    areaNames = list(polygons.keys())
 
-    pixelList = generate_2d_mesh(mapWidth, mapHeight)
+    if method == INFLUENCE_EDT:
+        names = areaLabelNames(scaledPolygons)
+        for areaName in scaledPolygons.keys():
+            influence = calcAreaInfluenceFromLabels(areaLabels.asArray(), names.index(areaName), fadeRadius)
+            maps[areaName] = GridMap(tile.width, tile.height, influence)
+        return normalizeGridMaps(maps)
+    elif method != INFLUENCE_EXACT:
+        raise Exception("Unknown influence method: {M}".format(M=method))
 
-    pool = multiprocessing.Pool(processes=4)
-    findContainingAreaForPixel_callable = findContainingAreaForPixel(polygons)
-    areaOfPixels = dict(pool.map(findContainingAreaForPixel_callable, pixelList))
+    executor = resolveExecutor(executor)
+    pixelList = tile.pixelList()
 
-    for areaName in areaNames:
+    for areaName in scaledPolygons.keys():
         calcInfluenceOnPixel_callable = calcPolygonInfluenceOnPixel(areaName,
-                                                                    polygons,
-                                                                    areaOfPixels,
-                                                                    fadeRadius * min(mapWidth, mapHeight))
+                                                                    scaledPolygons,
+                                                                    areaLabels,
+                                                                    tile,
+                                                                    fadeRadius)
 
-        influence = list(pool.map(calcInfluenceOnPixel_callable, pixelList))
+        influence = executor.map(calcInfluenceOnPixel_callable, pixelList)
 
-        maps[areaName] = GridMap(mapWidth, mapHeight)
+        maps[areaName] = GridMap(tile.width, tile.height)
         maps[areaName].importValues(influence)
 
     return normalizeGridMaps(maps)
 
 
+def generateAreaInfluenceMapFromPolygons(polygons: dict,
+                                         fadeRadius: float,
+                                         mapWidth: int,
+                                         mapHeight: int,
+                                         executor: PipelineExecutor = None,
+                                         method: string = INFLUENCE_EXACT) -> dict:
+    polygons = copy.deepcopy(polygons)
+    for area in polygons.keys():
+        polygons[area].scalePolygon(mapWidth, mapHeight)
+
+    return generateAreaInfluenceTile(polygons,
+                                     fadeRadius * min(mapWidth, mapHeight),
+                                     fullMapTile(mapWidth, mapHeight),
+                                     executor,
+                                     method)
+
+
 # ======================================================================================================================
 # Distance Calculator
 # ======================================================================================================================
@@ -112,6 +230,12 @@ class DistanceCalculator:
     def __call__(self, *args, **kwargs) -> float:
         return 0.0
 
+    def batch(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Distances between two broadcastable arrays of [x, y] positions with shape (..., 2).
+        """
+        return _elementwiseDistance(self, a, b)
+
 
 class ManhattanDistanceCalculator(DistanceCalculator):
     def __call__(self, *args, **kwargs):
@@ -120,6 +244,10 @@ class ManhattanDistanceCalculator(DistanceCalculator):
         d = a - b
         return math.fabs(d.X) + math.fabs(d.Y)
 
+    def batch(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        d = a - b
+        return np.abs(d[..., 0]) + np.abs(d[..., 1])
+
 
 class EuclideanDistanceCalculator(DistanceCalculator):
     def __call__(self, *args, **kwargs):
@@ -127,6 +255,10 @@ class EuclideanDistanceCalculator(DistanceCalculator):
         b = args[1]
         return (a - b).length
 
+    def batch(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        d = a - b
+        return np.sqrt(d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1])
+
 
 class ChebyshevDistanceCalculator(DistanceCalculator):
     def __call__(self, *args, **kwargs):
@@ -135,6 +267,76 @@ class ChebyshevDistanceCalculator(DistanceCalculator):
         d = a - b
         return max(math.fabs(d.X), math.fabs(d.Y))
 
+    def batch(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        d = a - b
+        return np.maximum(np.abs(d[..., 0]), np.abs(d[..., 1]))
+
+
+def _elementwiseDistance(distanceFunction, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    distances = [distanceFunction(Vector2D_fromList(p), Vector2D_fromList(q))
+                 for p, q in zip(a.reshape(-1, 2).tolist(), b.reshape(-1, 2).tolist())]
+    return np.array(distances, dtype=np.float64).reshape(a.shape[:-1])
+
+
+def batchDistance(distanceFunction, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if isinstance(distanceFunction, DistanceCalculator):
+        return distanceFunction.batch(a, b)
+    return _elementwiseDistance(distanceFunction, a, b)
+
+
+def batchSegmentDistances(points: np.ndarray, starts: np.ndarray, ends: np.ndarray, distanceFunction) -> np.ndarray:
+    """
+    Distances of N points to S segments as an (N, S) array, following Segment2D.getDistanceToPoint: the distance to
+    the projection of a point on the segment's line if it falls on the segment, otherwise to the nearest end.
+    """
+    v = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    start = np.asarray(starts, dtype=np.float64).reshape(1, -1, 2)
+    end = np.asarray(ends, dtype=np.float64).reshape(1, -1, 2)
+
+    direction = end - start
+    lengthSquared = direction[..., 0] * direction[..., 0] + direction[..., 1] * direction[..., 1]
+    length = np.sqrt(lengthSquared)
+
+    # zero length segments have no projection and fall back to their end points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normal = direction * (1 / length)[..., np.newaxis]
+        e = v - start
+        projection = (direction[..., 0] * e[..., 0] + direction[..., 1] * e[..., 1]) / length
+        p = start + normal * projection[..., np.newaxis]
+
+    low = np.minimum(start, end)
+    high = np.maximum(start, end)
+    offset = p - start
+    isOn = np.all((low <= p) & (p <= high), axis=-1) & \
+           (np.abs(direction[..., 0] * offset[..., 1] - direction[..., 1] * offset[..., 0]) < 0.001 * lengthSquared)
+
+    endDistance = np.minimum(batchDistance(distanceFunction, v, start), batchDistance(distanceFunction, v, end))
+    return np.where(isOn, batchDistance(distanceFunction, v, p), endDistance)
+
+
+def findNearestSkeletons(points: np.ndarray, skeletons: List[AreaSkeleton], distanceFunction, blockSize: int = 4096):
+    """
+    Index of the nearest skeleton and the distance to it for every [x, y] point. Ties go to the first skeleton.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    distances = np.empty((len(points), len(skeletons)))
+
+    for i, skeleton in enumerate(skeletons):
+        segments = skeleton.segments
+        if len(segments) == 0:
+            distances[:, i] = batchDistance(distanceFunction, points, np.array(skeleton.root.asList))
+            continue
+
+        starts = np.array([s.start.asList for s in segments])
+        ends = np.array([s.end.asList for s in segments])
+        for b in range(0, len(points), blockSize):
+            block = points[b:b + blockSize]
+            distances[b:b + blockSize, i] = batchSegmentDistances(block, starts, ends, distanceFunction).min(axis=1)
+
+    nearest = np.argmin(distances, axis=1)
+    return nearest, distances[np.arange(len(points)), nearest]
+
 
 # ======================================================================================================================
 # layout generation
@@ -169,69 +371,62 @@ def GeneratePolygonsFromAreaSkeletons(canvas: Canvas2D,
         elif BoundRadiusValues[area] <= 0:
             BoundRadiusValues[area] = 0.00001
 
-    polygons: Dict[str, AreaPolygon] = {}
-    emptyPolygon: AreaPolygon = AreaPolygon(EMPTY_POLY)
-    for s in skeletons:
-        polygons[s.areaName] = AreaPolygon(s.areaName)
+    # every seed gets the index of its area in 'areaNames', or 'emptyLabel'
+    areaNames = [s.areaName for s in skeletons]
+    emptyLabel = len(areaNames)
+    seedLabels = np.full(len(canvas), emptyLabel, dtype=np.int64)
 
     seeds = canvas.Seeds
-    for seed in seeds:
-        distances = list(map(
-            lambda skeleton:
-            skeleton.findDistanceToPoint(seed, distanceFunction),
-            skeletons))
+    nearestSkeletons, nearestDistances = findNearestSkeletons(canvas.pointsAsList, skeletons, distanceFunction)
+    nearestSkeletons = nearestSkeletons.tolist()
+    nearestDistances = nearestDistances.tolist()
 
-        minDist = min(distances)
+    for seedIndex, seed in enumerate(seeds):
+        minDist = nearestDistances[seedIndex]
         scaledMinDist = 1.1 * minDist
 
         # check if the seed is closer to skeleton than borders.
         # If so, assign it to nearest skeleton.
         # Otherwise, add it to empty polygon.
         if isSeedFarEnoughFromBorders(seed, scaledMinDist):
-            skeleton_index = distances.index(minDist)
+            skeleton_index = nearestSkeletons[seedIndex]
             areaName = skeletons[skeleton_index].areaName
 
             if minDist < BoundRadiusValues[areaName]:
-                polygons[areaName].addCell(seed, canvas.getPolygonOfSeed(seed))
-            else:
-                emptyPolygon.addCell(seed, canvas.getPolygonOfSeed(seed))
-        else:
-            emptyPolygon.addCell(seed, canvas.getPolygonOfSeed(seed))
+                seedLabels[seedIndex] = skeleton_index
 
-    def isSeedInOtherPolygonss(seedToCheck: Vector2D, areasToIgnore: list):
-        for a in polygons.keys():
-            if (not (a in areasToIgnore)) and (seedToCheck in polygons[a].seeds):
-                return True
-        return False
+    # cells of the empty polygon in the order they were added to it
+    emptySeedIndices = np.flatnonzero(seedLabels == emptyLabel).tolist()
 
-    def getNeighbourCellsInDepth(root_seed, depth: int) -> list:
-        neighbourCells = {root_seed}
-        for i in range(depth):
-            cells = copy.copy(neighbourCells)
-            for seed_to_check in cells:
-                neighbour_to_add_list = canvas.getNeighboursOfSeed(seed_to_check)
-                for neighbour_to_add in neighbour_to_add_list:
-                    neighbourCells.add(neighbour_to_add)
-        return list(neighbourCells)
-
-    # Move undesired cells to the empty polygon
-    postProcessedPolygons = polygons.copy()
-    for area in polygons.keys():
+    # Move undesired cells to the empty polygon: cells touching an area that is not a neighbour in the layout, along
+    # with their own area's cells within 'deletionDepth' steps
+    indptr, indices = canvas.neighbourArrays
+    neighbourOwners = np.repeat(np.arange(len(canvas)), np.diff(indptr))
+    for label, area in enumerate(areaNames):
         ignoreList = layoutSpec.getNeighbours(area)
         ignoreList.append(area)
 
-        for seed in polygons[area].seeds:
-            badCell = False
-            neighbours = canvas.getNeighboursOfSeed(seed)
-            for n in neighbours:
-                if isSeedInOtherPolygonss(n, ignoreList):
-                    badCell = True
+        isForeign = np.array([a not in ignoreList for a in areaNames] + [False])
+        foreignNeighbours = np.bincount(neighbourOwners,
+                                        weights=isForeign[seedLabels[indices]],
+                                        minlength=len(canvas))
+
+        areaSeedIndices = np.flatnonzero(seedLabels == label)
+        for seedIndex in areaSeedIndices[foreignNeighbours[areaSeedIndices] > 0]:
+            to_remove = canvas.getNeighbourhoodOfSeedIndex(seedIndex, deletionDepth)
+            to_remove = to_remove[seedLabels[to_remove] == label]
+            seedLabels[to_remove] = emptyLabel
+            emptySeedIndices.extend(to_remove.tolist())
 
-            if badCell:
-                to_remove = getNeighbourCellsInDepth(seed, deletionDepth)
-                for c in to_remove:
-                    postProcessedPolygons[area].removeCell(c)
-                    emptyPolygon.addCell(c, canvas.getPolygonOfSeed(c))
+    postProcessedPolygons: Dict[str, AreaPolygon] = {}
+    for label, area in enumerate(areaNames):
+        postProcessedPolygons[area] = AreaPolygon(area)
+        for seedIndex in np.flatnonzero(seedLabels == label).tolist():
+            postProcessedPolygons[area].addCell(seeds[seedIndex], canvas.getPolygonOfSeedIndex(seedIndex))
+
+    emptyPolygon: AreaPolygon = AreaPolygon(EMPTY_POLY)
+    for seedIndex in emptySeedIndices:
+        emptyPolygon.addCell(seeds[seedIndex], canvas.getPolygonOfSeedIndex(seedIndex))
 
     postProcessedPolygons[EMPTY_POLY] = emptyPolygon
     return postProcessedPolygons
@@ -248,21 +443,40 @@ def generateLandscapeMaps(mapWidth: int,
                           landscapeSettings: dict,
                           influenceMaps: dict,
                           heightMap: GridMap) -> dict:
-    maps = {}
-    for landscapeName in landscapes:
-        maps[landscapeName] = GridMap(mapWidth, mapHeight)
+    # contributions are accumulated in place, 'contribution' being the only temporary
+    landscapeStack = GridMapStack(list(landscapes.keys()), mapWidth, mapHeight)
+    layers = landscapeStack.asArray()
+    contribution = np.empty((mapHeight, mapWidth))
 
+    # bands of generators shared by several areas are only generated once
+    sharedBands = {}
     for areaName in landscapeSettings.keys():
-        ms: dict = landscapeSettings[areaName].generateLandscapeMaps(areaName,
-                                                                     mapWidth,
-                                                                     mapHeight,
-                                                                     landscapes,
-                                                                     influenceMaps,
-                                                                     heightMap)
-        for landscapeName in ms.keys():
-            maps[landscapeName] = addGrids(maps[landscapeName], ms[landscapeName])
+        generator = landscapeSettings[areaName]
+        if id(generator) not in sharedBands:
+            sharedBands[id(generator)] = generator.generateLandscapeBands(mapWidth,
+                                                                          mapHeight,
+                                                                          landscapes,
+                                                                          heightMap)
+        bands = sharedBands[id(generator)]
+
+        if bands is None:
+            ms: dict = generator.generateLandscapeMaps(areaName,
+                                                       mapWidth,
+                                                       mapHeight,
+                                                       landscapes,
+                                                       influenceMaps,
+                                                       heightMap)
+            for landscapeName in ms.keys():
+                layers[landscapeStack.indexOf(landscapeName)] += ms[landscapeName].asArray()
+        else:
+            influence = influenceMaps[areaName].asArray()
+            if not np.any(influence):
+                continue
+            for landscapeName, band in bands.items():
+                np.multiply(band.asArray() if isinstance(band, GridMap) else band, influence, out=contribution)
+                layers[landscapeStack.indexOf(landscapeName)] += contribution
 
-    return normalizeGridMaps(maps)
+    return landscapeStack.normalize(out=landscapeStack).toGridMaps()
 
 
 # ======================================================================================================================
@@ -279,20 +493,26 @@ def calcSurfaceTotalInfluence(surface: string, x: int, y: int, landscapeMaps: di
     return totalInfluence
 
 
-def generateSurfaceMaps(landscapeMaps: Dict, landscapes: Dict) -> dict:
-    maps: dict = {}
-    mapWidth = (list(landscapeMaps.values()))[0].width
-    mapHeight = (list(landscapeMaps.values()))[0].height
+def landscapeSurfaceIncidence(landscapeNames: list, landscapes: Dict):
+    """
+    Unique surface types, in the order they first appear in 'landscapes', and the (landscapes x surfaces) table
+    holding 1 where the landscape of a row has the surface of a column.
+    """
+    surfaces = list(dict.fromkeys(c.surfaceType for c in landscapes.values()))
+    incidence = np.zeros((len(landscapeNames), len(surfaces)))
+    for row, landscapeName in enumerate(landscapeNames):
+        incidence[row, surfaces.index(landscapes[landscapeName].surfaceType)] = 1.0
+    return surfaces, incidence
 
-    surfaces = [c.surfaceType for c in landscapes.values()]
-    pixelList = generate_2d_mesh(mapWidth, mapHeight)
 
-    for surface in surfaces:
-        m = [calcSurfaceTotalInfluence(surface, x, y, landscapeMaps, landscapes) for x, y in pixelList]
-        maps[surface] = GridMap(mapWidth, mapHeight)
-        maps[surface].importValues(m)
+def generateSurfaceMaps(landscapeMaps: Dict, landscapes: Dict) -> dict:
+    landscapeStack = GridMapStack_fromGridMaps(landscapeMaps)
+    surfaces, incidence = landscapeSurfaceIncidence(landscapeStack.names, landscapes)
 
-    return normalizeGridMaps(maps)
+    # one layer per unique surface, each the sum of the landscapes having that surface
+    surfaceLayers = np.tensordot(incidence, landscapeStack.asArray(), axes=(0, 0))
+    maps = GridMapStack(surfaces, landscapeStack.width, landscapeStack.height, surfaceLayers)
+    return maps.normalize().toGridMaps()
 
 
 # ======================================================================================================================
@@ -367,20 +587,125 @@ def assignItem(x: int, y: int, itemTypeMaps: dict, itemDensityMap: GridMap):
         return x, y, None
 
 
-def generateItemLocations(itemTypeMaps: dict, itemDensityMap: GridMap) -> dict:
-    mapWidth = (list(itemTypeMaps.values()))[0].width
-    mapHeight = (list(itemTypeMaps.values()))[0].height
+def poissonDiskThinning(xs: np.ndarray, ys: np.ndarray, minDistance: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Indices of a subset of the given points in which no two points are closer than 'minDistance'. Points are tried in
+    random order and kept if no kept point is near, found through a spatial hash whose cells are small enough to hold
+    a single kept point, so every test only looks at the 5x5 cells around the point. The hash is a dict of the cells
+    in use, so its size follows the number of points rather than the map size over 'minDistance'.
+    """
+    cellSize = minDistance / math.sqrt(2)
+    cellXs = np.floor(xs / cellSize).astype(np.int64).tolist()
+    cellYs = np.floor(ys / cellSize).astype(np.int64).tolist()
+    pointXs = xs.tolist()
+    pointYs = ys.tolist()
+    minDistanceSquared = minDistance * minDistance
+
+    def isNearKeptPoint(i):
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                j = cells.get((cellXs[i] + dx, cellYs[i] + dy))
+                if j is None:
+                    continue
+                if (pointXs[j] - pointXs[i]) ** 2 + (pointYs[j] - pointYs[i]) ** 2 < minDistanceSquared:
+                    return True
+        return False
 
-    pixelList = generate_2d_mesh(mapWidth, mapHeight)
+    cells = {}
+    kept = []
+    for i in rng.permutation(len(xs)).tolist():
+        if not isNearKeptPoint(i):
+            cells[(cellXs[i], cellYs[i])] = i
+            kept.append(i)
+    return np.sort(np.array(kept, dtype=np.int64))
+
+
+def generateItemLocations(itemTypeMaps: dict,
+                          itemDensityMap: GridMap,
+                          seed: int = None,
+                          minDistance: float = 0) -> dict:
+    """
+    Vectorized counterpart of assignItem for every pixel. A pixel gets an item with the chance given by the density
+    map, and its type is picked by comparing a second uniform draw with the cumulative type weights. Both draws come
+    from a generator made from 'seed', so equal seeds place equal items. A 'minDistance' above one pixel additionally
+    thins the items with poissonDiskThinning, so no two items end up closer than that. Items on distinct pixels are
+    always at least one pixel apart, so smaller distances keep every item.
+    Locations of every type are [x, y] pairs in row-major order.
+    """
+    mapWidth = itemDensityMap.width
+    mapHeight = itemDensityMap.height
+    itemTypes = list(itemTypeMaps.keys())
+    rng = np.random.default_rng(seed)
+
+    chanceOfItem = rng.random((mapHeight, mapWidth))
+    typeRand = rng.random((mapHeight, mapWidth))
+
+    hasItem = chanceOfItem < itemDensityMap.asArray()
+    if len(itemTypes) > 0:
+        # the first type whose cumulative weight reaches typeRand, as in searchsorted(..., side="left")
+        cumulativeWeights = np.cumsum(GridMapStack_fromGridMaps(itemTypeMaps).asArray(), axis=0)
+        typeIndices = np.sum(cumulativeWeights < typeRand, axis=0)
+    else:
+        typeIndices = np.zeros((mapHeight, mapWidth), dtype=np.int64)
+    hasItem &= typeIndices < len(itemTypes)
 
-    locations: dict = {}
-    assignments = [assignItem(x, y, itemTypeMaps, itemDensityMap) for x, y in pixelList]
+    ys, xs = np.nonzero(hasItem)
+    types = typeIndices[ys, xs]
+    if minDistance > 1 and len(xs) > 0:
+        kept = poissonDiskThinning(xs.astype(np.float64), ys.astype(np.float64), minDistance, rng)
+        xs, ys, types = xs[kept], ys[kept], types[kept]
+
+    # group by type in one pass, the stable sort keeps the row-major order within each type
+    order = np.argsort(types, kind="stable")
+    bounds = np.searchsorted(types[order], np.arange(len(itemTypes) + 1))
+    positions = np.stack([xs[order], ys[order]], axis=1).tolist()
 
-    for itemType in itemTypeMaps.keys():
-        locations[itemType] = [[assign[0], assign[1]] for assign in assignments if assign[2] == itemType]
+    locations: dict = {}
+    for i, itemType in enumerate(itemTypes):
+        locations[itemType] = positions[bounds[i]:bounds[i + 1]]
     return locations
 
 
+# ======================================================================================================================
+# Fused Landscape Layers
+# ======================================================================================================================
+
+def generateSurfaceAndItemMaps(landscapeMaps: Dict, landscapes: Dict):
+    """
+    Surface maps, item density map and item type maps in a single pass. Each of those layers is a weighted sum of the
+    landscape layers, so the weights of all of them form one (landscapes x layers) matrix that is applied to the
+    stacked landscape maps with a single matrix product. Item types keep the order they first appear in.
+    """
+    landscapeNames = list(landscapeMaps.keys())
+    landscapeStack = GridMapStack_fromGridMaps(landscapeMaps)
+    mapWidth = landscapeStack.width
+    mapHeight = landscapeStack.height
+
+    surfaces, surfaceWeights = landscapeSurfaceIncidence(landscapeNames, landscapes)
+    itemTypes = list(dict.fromkeys(itemType for c in landscapes.values() for itemType in c.itemTypes.keys()))
+
+    densityWeights = np.array([[landscapes[l].itemDensity] for l in landscapeNames]).reshape(len(landscapeNames), 1)
+    itemWeights = np.array([[landscapes[l].getItemWeight(itemType) for itemType in itemTypes]
+                            for l in landscapeNames]).reshape(len(landscapeNames), len(itemTypes))
+
+    weights = np.hstack([surfaceWeights, densityWeights, itemWeights])
+    layers = (weights.T @ landscapeStack.asArray().reshape(len(landscapeNames), -1))
+    layers = layers.reshape(-1, mapHeight, mapWidth)
+
+    surfaceMaps = GridMapStack(surfaces, mapWidth, mapHeight, layers[:len(surfaces)]).normalize().toGridMaps()
+    itemDensityMap = GridMap(mapWidth, mapHeight, layers[len(surfaces)])
+
+    # every item type is first stretched to [0, 1] on its own, as in normalizeGridMapValues
+    itemLayers = layers[len(surfaces) + 1:]
+    lower = itemLayers.min(axis=(1, 2), initial=np.inf, keepdims=True)
+    upper = itemLayers.max(axis=(1, 2), initial=-np.inf, keepdims=True)
+    spread = upper - lower
+    itemLayers = np.divide(itemLayers - lower, spread, out=np.zeros_like(itemLayers), where=spread != 0)
+    itemTypeMaps = GridMapStack(itemTypes, mapWidth, mapHeight, itemLayers).normalize().toGridMaps()
+
+    return surfaceMaps, itemDensityMap, itemTypeMaps
+
+
 # ======================================================================================================================
 # Landscape process
 # ======================================================================================================================
@@ -390,7 +715,9 @@ def generateLandscapeData(landscapes: dict,
                           mapWidth: int,
                           mapHeight: int,
                           influenceMaps: dict,
-                          heightMap: GridMap):
+                          heightMap: GridMap,
+                          itemSeed: int = None,
+                          minItemDistance: float = 0):
     landscapeMaps = generateLandscapeMaps(mapWidth=mapWidth,
                                           mapHeight=mapHeight,
                                           landscapes=landscapes,
@@ -398,11 +725,8 @@ def generateLandscapeData(landscapes: dict,
                                           influenceMaps=influenceMaps,
                                           heightMap=heightMap)
 
-    surfaceMaps = generateSurfaceMaps(landscapeMaps=landscapeMaps, landscapes=landscapes)
-
-    itemDensityMap = generateItemDensityMap(landscapeMaps, landscapes)
-    itemTypeMaps = generateItemTypeMaps(landscapeMaps, landscapes)
-    itemLocations = generateItemLocations(itemTypeMaps, itemDensityMap)
+    surfaceMaps, itemDensityMap, itemTypeMaps = generateSurfaceAndItemMaps(landscapeMaps, landscapes)
+    itemLocations = generateItemLocations(itemTypeMaps, itemDensityMap, itemSeed, minItemDistance)
 
     return landscapeMaps, surfaceMaps, itemDensityMap, itemTypeMaps, itemLocations
 
@@ -423,23 +747,93 @@ def generateHeightMapFromElevationSettings(mapWidth: int,
                                            polygons: dict,
                                            influenceMaps: dict,
                                            heightSettings: dict) -> GridMap:
-    partialHeightMaps: dict = {}
     scaledPolygons = copy.deepcopy(polygons)
     for area in scaledPolygons.keys():
         scaledPolygons[area].scalePolygon(mapWidth, mapHeight)
 
+    return generateHeightTile(mapWidth, mapHeight, scaledPolygons, influenceMaps, heightSettings)
+
+
+def generateHeightTile(mapWidth: int,
+                       mapHeight: int,
+                       scaledPolygons: dict,
+                       influenceMaps: dict,
+                       heightSettings: dict,
+                       tile: MapTile = None) -> GridMap:
+    """
+    Height map of one tile (the whole map if 'tile' is None) from influence maps covering that tile. Foundations of an
+    area are only evaluated inside the bounding box of its non-zero influence, which is the area dilated by the fade
+    radius, and composited into that part of the tile. Detail noise is cached for the whole tile and cut to each box,
+    so areas sharing a noise generator share one noise map.
+    """
+    bounds = tile if tile is not None else fullMapTile(mapWidth, mapHeight)
+    heights = np.zeros((bounds.height, bounds.width))
+
     for area in scaledPolygons.keys():
-        partialHeightMaps[area] = heightSettings[area].heightMapForPolygon(scaledPolygons[area], mapWidth,
-                                                                           mapHeight)
+        influence = influenceMaps[area].asArray()
+        region = nonzeroTile(influence, bounds)
+        if region.isEmpty:
+            continue
 
-    pixelList = generate_2d_mesh(mapWidth, mapHeight)
+        # the whole map keeps tile=None, so foundations can take their full-map path
+        regionTile = None if tile is None and region == bounds else region
+        partialHeight = heightSettings[area].heightMapForPolygon(scaledPolygons[area],
+                                                                 mapWidth,
+                                                                 mapHeight,
+                                                                 regionTile,
+                                                                 bounds)
+        window = region.slicesIn(bounds)
+        heights[window] += influence[window] * partialHeight.asArray()
+
+    return GridMap(bounds.width, bounds.height, heights)
+
+
+# ======================================================================================================================
+# Tiled Elevation
+# ======================================================================================================================
+
+def generateTiledElevation(mapWidth: int,
+                           mapHeight: int,
+                           polygons: dict,
+                           fadeRadius: float,
+                           heightSettings: dict,
+                           directory: string,
+                           tileSize: int = 512,
+                           dtype=np.float32,
+                           executor: PipelineExecutor = None,
+                           influenceMethod: string = INFLUENCE_EXACT) -> (GridMapStack, GridMap):
+    """
+    Generates influence and height maps tile by tile and streams them into 'influence.npy' and 'height.npy' inside
+    'directory'. Noise and foundations are evaluated in the coordinates of the whole map, so tiles meet without
+    seams, and only one tile of every map is held in memory at a time. Returns the disk-backed maps.
+    With INFLUENCE_EDT every tile is computed with a halo of the fade radius and then cropped.
+    """
+    scaledPolygons = copy.deepcopy(polygons)
+    for area in scaledPolygons.keys():
+        scaledPolygons[area].scalePolygon(mapWidth, mapHeight)
+
+    areaNames = list(scaledPolygons.keys())
+    influenceStack = openDiskGridMapStack(os.path.join(directory, "influence.npy"),
+                                          areaNames, mapWidth, mapHeight, dtype)
+    heightMap = openDiskGridMap(os.path.join(directory, "height.npy"), mapWidth, mapHeight, dtype)
+
+    executor = resolveExecutor(executor)
+    fadeRadius = fadeRadius * min(mapWidth, mapHeight)
+    halo = int(math.ceil(fadeRadius)) + 1 if influenceMethod == INFLUENCE_EDT else 0
+    for tile in splitIntoTiles(mapWidth, mapHeight, tileSize):
+        haloTile = tile.dilated(halo, mapWidth, mapHeight)
+        influenceMaps = generateAreaInfluenceTile(scaledPolygons, fadeRadius, haloTile, executor, influenceMethod)
+
+        tileInfluenceMaps = {}
+        for area in areaNames:
+            influence = influenceMaps[area].asArray()[tile.slicesIn(haloTile)]
+            influenceStack.asArray()[(influenceStack.indexOf(area),) + tile.slices] = influence
+            tileInfluenceMaps[area] = GridMap(tile.width, tile.height, influence)
 
-    heightValues = \
-        [calcHeightOfPixelFromPartialHeightMaps(x, y, influenceMaps, partialHeightMaps) for x, y in pixelList]
+        heightTile = generateHeightTile(mapWidth, mapHeight, scaledPolygons, tileInfluenceMaps, heightSettings, tile)
+        heightMap.asArray()[tile.slices] = heightTile.asArray()
 
-    heightMap = GridMap(mapWidth, mapHeight)
-    heightMap.importValues(heightValues)
-    return heightMap
+    return influenceStack, heightMap
 
 
 # ======================================================================================================================